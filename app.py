@@ -1,113 +1,685 @@
 """
 Flask app and endpoints
+
+matplotlib and the plotting modules are imported on first use, and the cache index is
+loaded on first use, so a new worker answers the / healthcheck almost at once. Set
+BPHO_PRELOAD=1 to load everything at import instead, e.g. in a gunicorn master started
+with --preload so the workers fork with it already loaded
+
+Serve it with a WSGI server (gunicorn app:app), or with an ASGI server through asgi.py,
+which answers cache hits without waiting behind renders
 """
-from flask import Flask, request, send_from_directory
-from bpho_service import generate_kepler_correlation, generate_2d_orbit, generate_3d_orbit, generate_2d_orbit_animation, generate_3d_orbit_animation, generate_angle_vs_time, generate_spinograph, generate_2d_imaginary_orbit, generate_3d_imaginary_orbit
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Startup timer, reported in the log and as bpho_startup_seconds
+startup_start = time.perf_counter()
+
+from flask import Flask, Response, g, jsonify, request, url_for
+from werkzeug.datastructures import MultiDict
 from cache import Cache
+from formats import still_formats, animation_formats, default_still_format, default_animation_format, still_preference, animation_preference
+from render_queue import RenderQueue, RenderTask, QueueFull, load_service
+from metrics import metrics, start_request_timing, finish_request_timing
+from constants.data import get_planet
+from cache_keys import render_version, make_etag, InvalidParameters, normalise_planet, normalise_planets, escape_name, planets_part, kepler_correlation_key, orbit_image_key, orbit_animation_key, angle_vs_time_key, spinograph_key, imaginary_orbit_key, sampling_parts, time_span_parts, timing_parts, data_key
 
 
 app = Flask(__name__)
 
 
 cache = Cache()
-cache.register_cache()
+
+# Animations are rendered in the background by this many worker threads. Once max_queued
+# jobs are waiting, new ones are answered 503 with Retry-After
+render_queue = RenderQueue(cache, workers=2, max_queued=64)
+
+metrics.gauge("render_queue_depth", render_queue.depth, "Background renders waiting for a worker")
+metrics.gauge("cache_files", lambda: len(cache.cache), "Files in the cache index")
+metrics.gauge("cache_bytes", lambda: cache.total_bytes, "Size of the files in the cache index")
+metrics.gauge("hot_cache_bytes", lambda: cache.hot.total_bytes, "Size of the files kept in memory")
+
+metrics.gauge("startup_seconds", lambda: startup_seconds, "Time from the start of importing app.py until it was ready")
+
+
+def data():
+    import data_api
+    return data_api
+
+
+def computation():
+    import bpho_computation
+    return bpho_computation
+
+
+def preload() -> None:
+    """
+    Imports the plotting modules and loads the cache index now instead of on first use
+    """
+    load_service()
+    data()
+    cache.register_cache()
+
+# Send the time spent in every render stage of a request in a Server-Timing header
+send_server_timing = True
+
+# Longest long-poll allowed on /jobs/<id>, in seconds
+max_job_wait = 30
+
+# Most charts in one /batch request, and the threads rendering the missing ones
+max_batch_charts = 16
+batch_executor = ThreadPoolExecutor(max_workers=4)
+
+# Points per series in /data JSON responses unless max_points is given
+default_json_max_points = 2000
+
+# Allowed points per orbit path (?resolution=) and chord error (?tolerance=, a fraction of
+# the semi-major axis) of the orbit sampling
+min_resolution, max_resolution = 8, 20000
+min_tolerance, max_tolerance = 1e-6, 0.1
+
+# Limits of the animation timing: playback seconds (?duration=), frames per second (?fps=),
+# frame budget (?max_frames=, the same as bpho_computation's hard cap) and start epoch
+# (?start=, modified years)
+max_animation_duration = 600
+max_animation_fps = 60
+max_animation_frames = 320
+max_animation_start = 1e6
+
+# Most lines drawn between the two planets of a spinograph (?segments=)
+max_spinograph_segments = 20000
+
+# Longest time span (?span=, years) and most time steps per planet of the imaginary orbits
+max_imaginary_span = 100000
+max_imaginary_steps = 200000
+
+
+def parse_number(args, name: str, number_type, default=None):
+    """
+    Reads an optional int or float parameter. Unlike args.get(name, type=...), which
+    answers the default, a value that does not parse raises InvalidParameters
+    """
+    value = args.get(name)
+    if value is None:
+        return default
+    try:
+        return number_type(value)
+    except ValueError:
+        raise InvalidParameters(f"{name} must be {'an integer' if number_type is int else 'a number'}")
+
+
+def parse_sampling(args) -> (int, float):
+    """
+    Reads the optional resolution or tolerance of the orbit sampling
+    """
+    resolution = parse_number(args, 'resolution', int)
+    tolerance = parse_number(args, 'tolerance', float)
+
+    if resolution is not None and tolerance is not None:
+        raise InvalidParameters("Give either resolution or tolerance, not both")
+    if resolution is not None and not min_resolution <= resolution <= max_resolution:
+        raise InvalidParameters(f"resolution must be between {min_resolution} and {max_resolution}")
+    if tolerance is not None and not min_tolerance <= tolerance <= max_tolerance:
+        raise InvalidParameters(f"tolerance must be between {min_tolerance} and {max_tolerance}")
+
+    return resolution, tolerance
+
+
+def parse_animation_timing(args) -> (float, float, int, float):
+    """
+    Reads the optional duration, fps, frame budget and start epoch of an animation
+    """
+    duration = parse_number(args, 'duration', float)
+    fps = parse_number(args, 'fps', float, default=15)
+    max_frames = parse_number(args, 'max_frames', int)
+    start = parse_number(args, 'start', float, default=0)
+
+    if duration is not None and not 0 < duration <= max_animation_duration:
+        raise InvalidParameters(f"duration must be positive and at most {max_animation_duration} seconds")
+    if not 0 < fps <= max_animation_fps:
+        raise InvalidParameters(f"fps must be positive and at most {max_animation_fps}")
+    if max_frames is not None and not 1 <= max_frames <= max_animation_frames:
+        raise InvalidParameters(f"max_frames must be between 1 and {max_animation_frames}")
+    if not -max_animation_start <= start <= max_animation_start:
+        raise InvalidParameters(f"start must be between {-max_animation_start:g} and {max_animation_start:g}")
+
+    return duration, fps, max_frames, start
+
+
+def parse_spinograph_segments(args) -> int:
+    num_segments = parse_number(args, 'segments', int, default=1234)
+    if not 0 < num_segments <= max_spinograph_segments:
+        raise InvalidParameters(f"segments must be positive and at most {max_spinograph_segments}")
+    return num_segments
+
+
+def parse_imaginary_times(args) -> (int, float, float):
+    """
+    Reads the number of time steps, the time span (years) and the time step (years) of
+    the imaginary orbits. Without a span every planet keeps its own default time span
+    """
+    # The relative orbits are sampled in time, so the orbit sampling does not apply
+    resolution = parse_number(args, 'resolution', int)
+    span = parse_number(args, 'span', float)
+    step = parse_number(args, 'step', float)
+
+    if span is None and step is not None:
+        raise InvalidParameters("step needs a span")
+    if resolution is not None and step is not None:
+        raise InvalidParameters("Give either resolution or step, not both")
+    if span is not None and not 0 < span <= max_imaginary_span:
+        raise InvalidParameters(f"span must be positive and at most {max_imaginary_span} years")
+    if step is not None and not (step > 0 and span / step < max_imaginary_steps):
+        raise InvalidParameters(f"step must be positive and give at most {max_imaginary_steps} steps")
+
+    resolution = 1000 if resolution is None else resolution
+    if not min_resolution <= resolution <= max_imaginary_steps:
+        raise InvalidParameters(f"resolution must be between {min_resolution} and {max_imaginary_steps}")
+    return resolution, span, step
+
+def parse_format(args, is_animation: bool) -> str:
+    """
+    Reads ?format=, or else picks the smallest format whose media type the Accept header
+    lists by name (wildcards do not count), or else the default format
+    """
+    formats = animation_formats if is_animation else still_formats
+    requested = args.get('format')
+    if requested is not None:
+        if requested not in formats:
+            raise InvalidParameters("format must be one of " + ", ".join(formats))
+        return requested
+
+    # The response now depends on the Accept header, see add_vary_header
+    g.negotiated_format = True
+    accepted = {mimetype for mimetype, quality in request.accept_mimetypes if quality > 0}
+    for name in animation_preference if is_animation else still_preference:
+        if formats[name].mimetype in accepted:
+            return name
+    return default_animation_format if is_animation else default_still_format
+
+# Seconds a request waits for another request that is rendering the same file
+render_wait_timeout = 30
+
+# Retry-After (seconds) of the 503 answered when too many renders are waiting
+saturated_retry_after = 5
+
+# Browser/CDN caching of files requested with ?v=<render_version>, whose content can
+# never change, and of files requested without it
+versioned_cache_control = "public, max-age=31536000, immutable"
+unversioned_cache_control = "public, max-age=3600"
+
+
+def send_cached(filename: str, render):
+    """
+    Sends a file from the cache, rendering it first if needed. Concurrent requests for
+    the same missing file share one render; if it takes longer than render_wait_timeout
+    the waiting requests are asked to retry
+    """
+    if is_not_modified(filename):
+        return send_not_modified(filename)
+
+    if not cache.get_or_render(filename, render, timeout=render_wait_timeout):
+        return "Still rendering, please retry", 202, {"Retry-After": "5", "Cache-Control": "no-store"}
+
+    try:
+        cached_file = cache.read(filename)
+    except FileNotFoundError:
+        # the file was deleted from the cache folder behind the index's back
+        cache.delete(filename)
+        if not cache.get_or_render(filename, render, timeout=render_wait_timeout):
+            return "Still rendering, please retry", 202, {"Retry-After": "5", "Cache-Control": "no-store"}
+        cached_file = cache.read(filename)
+
+    return send_file_bytes(cached_file)
+
+
+def send_cached_or_queue(filename: str, render):
+    """
+    Sends a file from the cache, or queues render(progress) in the background and answers
+    202 with the job, whose progress can be followed at /jobs/<id>
+    """
+    if is_not_modified(filename):
+        return send_not_modified(filename)
+
+    if cache.get(filename) is not None:
+        try:
+            response = send_file_bytes(cache.read(filename))
+            metrics.inc("cache_requests_total", result="hit")
+            return response
+        except FileNotFoundError:
+            cache.delete(filename)
+
+    # counted as a miss (or shared) by the render queue's worker, through get_or_render
+    try:
+        job = render_queue.submit(filename, request.full_path, render, priority=animation_priority(render))
+    except QueueFull:
+        return send_saturated()
+    return send_job(job, 202)
+
+
+def animation_priority(render: RenderTask) -> int:
+    """
+    Queue priority of an animation render: its number of frames, so short animations are
+    not stuck behind long ones
+    """
+    kwargs = render.kwargs
+    timing = computation().AnimationTiming(kwargs["duration"], kwargs["fps"], kwargs["max_frames"], kwargs["start"])
+    delay_step = animation_formats[kwargs["animation_format"]].delay_step
+    num_frames, _, _, _ = computation().get_animation_frames([get_planet(name) for name in render.args[0]], timing, delay_step)
+    return num_frames
+
+
+def send_saturated():
+    return "Too many renders in progress, please retry", 503, {"Retry-After": str(saturated_retry_after), "Cache-Control": "no-store"}
+
+
+def send_job(job, status: int):
+    response = jsonify(job.to_dict())
+    response.status_code = status
+    response.headers["Location"] = url_for("job_status", job_id=job.id)
+    response.headers["Cache-Control"] = "no-store"
+    if not job.is_finished():
+        response.headers["Retry-After"] = "2"
+    return response
+
+
+def send_data(endpoint: str, parts: list[str], build_series):
+    """
+    Streams the series from build_series() as JSON (?format=json, the default, downsampled
+    to max_points per series) or as little-endian float32 (?format=binary, described by the
+    X-Data-Layout header)
+    """
+    data_format = request.args.get('format', default='json')
+    if data_format not in ('json', 'binary'):
+        raise InvalidParameters("format must be json or binary")
+    max_points = parse_number(request.args, 'max_points', int, default=default_json_max_points if data_format == 'json' else None)
+    if max_points is not None and max_points < 2:
+        raise InvalidParameters("max_points must be at least 2")
+
+    key = data_key(endpoint, parts, data_format, max_points)
+    if is_not_modified(key):
+        return send_not_modified(key)
+
+    series = data().downsample(build_series(), max_points)
+    if data_format == 'json':
+        response = Response(data().encode_json(series), mimetype="application/json")
+    else:
+        response = Response(data().encode_binary(series), mimetype="application/octet-stream")
+        response.headers["X-Data-Layout"] = json.dumps(data().binary_layout(series))
+
+    set_caching_headers(response, make_etag(key))
+    return response
+
+
+def is_not_modified(filename: str) -> bool:
+    # The ETag only depends on the key, so a client's copy can be confirmed without disk I/O
+    return request.if_none_match.contains(make_etag(filename))
+
+
+def send_not_modified(filename: str):
+    response = Response(status=304)
+    set_caching_headers(response, make_etag(filename))
+    return response
+
+
+def send_file_bytes(cached_file):
+    response = Response(cached_file.data, mimetype=cached_file.mimetype)
+    response.headers["Content-Length"] = str(cached_file.content_length)
+    set_caching_headers(response, cached_file.etag)
+    return response
+
+
+def set_caching_headers(response, etag: str) -> None:
+    response.set_etag(etag)
+    is_versioned = request.args.get('v') == str(render_version)
+    response.headers["Cache-Control"] = versioned_cache_control if is_versioned else unversioned_cache_control
+
+
+@app.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    start_request_timing()
+
+
+@app.after_request
+def add_server_timing_header(response):
+    stages = finish_request_timing()
+    if send_server_timing:
+        timings = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items()]
+        timings.append(f"total;dur={(time.perf_counter() - g.request_start) * 1000:.1f}")
+        response.headers["Server-Timing"] = ", ".join(timings)
+    return response
+
+
+@app.after_request
+def add_vary_header(response):
+    if g.get('negotiated_format'):
+        response.vary.add("Accept")
+    return response
+
+
+@app.errorhandler(InvalidParameters)
+def invalid_parameters(exc):
+    return str(exc), 400
+
 
 @app.route("/")
 def healthcheck():
     return "App is working!"
 
 
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+## CHARTS
+
+# Every chart parses its parameters (a MultiDict, request.args for the chart endpoints)
+# into its cache key and a RenderTask, so /batch accepts the same parameters and the
+# ASGI server (asgi.py) can render in another process
+
+def kepler_correlation_chart(args) -> (str, RenderTask):
+    image_format = parse_format(args, is_animation=False)
+    filename = kepler_correlation_key(image_format)
+    return filename, RenderTask("generate_kepler_correlation", (filename, image_format))
+
+
+def orbit_image_chart(args) -> (str, RenderTask):
+    input_planets = normalise_planets(args.getlist('planet'))
+    is_3d = args.get('is3d') == "true"
+    resolution, tolerance = parse_sampling(args)
+    image_format = parse_format(args, is_animation=False)
+
+    filename = orbit_image_key(input_planets, is_3d, resolution, tolerance, image_format)
+
+    return filename, RenderTask("generate_3d_orbit" if is_3d else "generate_2d_orbit", (input_planets, filename, resolution, tolerance, image_format))
+
+
+def orbit_animation_chart(args) -> (str, RenderTask):
+    input_planets = normalise_planets(args.getlist('planet'))
+    is_3d = args.get('is3d') == "true"
+    resolution, tolerance = parse_sampling(args)
+    animation_format = parse_format(args, is_animation=True)
+    duration, fps, max_frames, start = parse_animation_timing(args)
+
+    filename = orbit_animation_key(input_planets, is_3d, resolution, tolerance, animation_format, duration, fps, max_frames, start)
+
+    return filename, RenderTask("generate_3d_orbit_animation" if is_3d else "generate_2d_orbit_animation", (input_planets, filename),
+                                dict(resolution=resolution, tolerance=tolerance, animation_format=animation_format,
+                                     duration=duration, fps=fps, max_frames=max_frames, start=start))
+
+
+def angle_vs_time_chart(args) -> (str, RenderTask):
+    input_planet = normalise_planet(args.get('planet'))
+    image_format = parse_format(args, is_animation=False)
+
+    filename = angle_vs_time_key(input_planet, image_format)
+
+    return filename, RenderTask("generate_angle_vs_time", (input_planet, filename, image_format))
+
+
+def spinograph_chart(args) -> (str, RenderTask):
+    input_planets = normalise_planets(args.getlist('planet'))
+    num_segments = parse_spinograph_segments(args)
+    resolution, tolerance = parse_sampling(args)
+
+    if len(input_planets) != 2:
+        raise InvalidParameters("A spinograph needs two different planets")
+
+    image_format = parse_format(args, is_animation=False)
+
+    filename = spinograph_key(input_planets, num_segments, resolution, tolerance, image_format)
+
+    return filename, RenderTask("generate_spinograph", (input_planets, filename, num_segments, resolution, tolerance, image_format))
+
+
+def imaginary_orbit_chart(args) -> (str, RenderTask):
+    centre_planet = normalise_planet(args.get('centre'))
+    input_planets = normalise_planets(args.getlist('planet'))
+    is_3d = args.get('is3d') == "true"
+    resolution, span, step = parse_imaginary_times(args)
+    image_format = parse_format(args, is_animation=False)
+
+    filename = imaginary_orbit_key(centre_planet, input_planets, is_3d, resolution, span, step, image_format)
+
+    return filename, RenderTask("generate_3d_imaginary_orbit" if is_3d else "generate_2d_imaginary_orbit", (centre_planet, input_planets, filename, resolution, span, step, image_format))
+
+
+# Chart endpoint -> chart function
+charts = {
+    "kepler_correlation": kepler_correlation_chart,
+    "orbit_image": orbit_image_chart,
+    "orbit_animation": orbit_animation_chart,
+    "angle_vs_time": angle_vs_time_chart,
+    "spinograph": spinograph_chart,
+    "imaginary_orbit": imaginary_orbit_chart,
+}
+
+
 @app.route('/kepler_correlation')
 def kepler_correlation():
-    filename = "kepler_correlation.png"
-
-    if cache.get(filename) is None:
-        generate_kepler_correlation(filename)
-        cache.set(filename, True)
-    
-    return send_from_directory(directory='cache', path=filename, as_attachment=False)
+    return send_cached(*kepler_correlation_chart(request.args))
 
 
 @app.route('/orbit_image')
 def orbit_image():
-    args = request.args
-    input_planets = args.getlist('planet')
-    is_3d = args.get('is3d')
+    return send_cached(*orbit_image_chart(request.args))
 
-    prefix = "3d_img-" if is_3d == "true" else "2d_img-"
-    filename = prefix + "_".join(input_planets) + ".png"
 
-    if cache.get(filename) is None:
-        generate_3d_orbit(input_planets, filename) if is_3d == "true" else generate_2d_orbit(input_planets, filename)
-        cache.set(filename, True)
+@app.route('/orbit_animation')
+def orbit_animation():
+    return send_cached_or_queue(*orbit_animation_chart(request.args))
 
-    return send_from_directory(directory='cache', path=filename, as_attachment=False)
 
+@app.route('/angle_vs_time')
+def angle_vs_time():
+    return send_cached(*angle_vs_time_chart(request.args))
 
-@app.route('/orbit_animation')
-def orbit_animation():
-    args = request.args
-    input_planets = args.getlist('planet')
-    is_3d = args.get('is3d')
 
-    prefix = "3d_anim-" if is_3d == "true" else "2d_anim-"
-    filename = prefix + "_".join(input_planets) + ".gif"
+@app.route('/spinograph')
+def spinograph():
+    return send_cached(*spinograph_chart(request.args))
 
-    if cache.get(filename) is None:
-        generate_3d_orbit_animation(input_planets, filename) if is_3d == "true" else generate_2d_orbit_animation(input_planets, filename)
-        cache.set(filename, True)
 
-    return send_from_directory(directory='cache', path=filename, as_attachment=False)
+@app.route('/imaginary_orbit')
+def imaginary_orbit():
+    return send_cached(*imaginary_orbit_chart(request.args))
+
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """
+    Renders several charts in one request, e.g. every chart of a dashboard page. The body
+    is {"charts": [{"chart": "orbit_image", "planet": ["Earth", "Mars"], "is3d": true}, ...]}
+    with the same parameters as the chart endpoints. The missing files are rendered
+    concurrently, and share the orbit paths they have in common; missing animations are
+    queued like on /orbit_animation, with their job's URL in the manifest. Answers a JSON
+    manifest of every chart's URL and status, or with ?response=multipart a
+    multipart/mixed body of the manifest followed by every rendered file
+    """
+    response_type = request.args.get('response', default='manifest')
+    if response_type not in ('manifest', 'multipart'):
+        raise InvalidParameters("response must be manifest or multipart")
+
+    manifest, filenames, futures = [], [], []
+    for index, (chart, args) in enumerate(parse_batch(request.get_json(silent=True))):
+        try:
+            # The format is put in the URL, since whatever fetches it sends another Accept
+            # header than this POST and would otherwise be negotiated to another file
+            if 'format' not in args:
+                args['format'] = parse_format(args, is_animation=chart == "orbit_animation")
+            filename, render = charts[chart](args)
+        except InvalidParameters as exc:
+            raise InvalidParameters(f"charts[{index}]: {exc}")
+
+        # v is set here, and url_for keeps _-prefixed names for itself
+        url_args = {name: values for name, values in args.to_dict(flat=False).items() if name != 'v' and not name.startswith('_')}
+        url = url_for(chart, v=render_version, **url_args)
+        entry = {"chart": chart, "url": url, "etag": make_etag(filename), "status": "ready", "job": None, "error": None}
+
+        future = None
+        if chart != "orbit_animation":
+            future = batch_executor.submit(cache.get_or_render, filename, render, render_wait_timeout)
+        elif cache.get(filename) is not None:
+            metrics.inc("cache_requests_total", result="hit")
+        else:
+            try:
+                job = render_queue.submit(filename, url, render, priority=animation_priority(render))
+                entry["status"], entry["job"] = "rendering", url_for("job_status", job_id=job.id)
+            except QueueFull:
+                entry["status"], entry["error"] = "failed", "Too many renders in progress"
+
+        manifest.append(entry)
+        filenames.append(filename)
+        futures.append(future)
+
+    for entry, future in zip(manifest, futures):
+        if future is None:
+            continue
+        try:
+            if not future.result():
+                entry["status"] = "rendering"
+        except Exception as exc:
+            entry["status"], entry["error"] = "failed", repr(exc)
+
+    if response_type == 'manifest':
+        response = jsonify({"charts": manifest})
+    else:
+        response = send_multipart(manifest, filenames)
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+def parse_batch(body) -> list[tuple]:
+    """
+    Returns the (chart, args) of every chart spec in a /batch body, with args as the
+    MultiDict the chart's endpoint would have been given
+    """
+    if not isinstance(body, dict) or not isinstance(body.get("charts"), list):
+        raise InvalidParameters('The body must be JSON like {"charts": [{"chart": "orbit_image", ...}]}')
+    if not 0 < len(body["charts"]) <= max_batch_charts:
+        raise InvalidParameters(f"A batch needs between 1 and {max_batch_charts} charts")
+
+    def query_value(value) -> str:
+        return ("true" if value else "false") if isinstance(value, bool) else str(value)
+
+    specs = []
+    for index, spec in enumerate(body["charts"]):
+        if not isinstance(spec, dict) or spec.get("chart") not in charts:
+            raise InvalidParameters(f"charts[{index}]: chart must be one of " + ", ".join(charts))
+        args = MultiDict([(name, query_value(value))
+                          for name, values in spec.items() if name != "chart"
+                          for value in (values if isinstance(values, list) else [values])])
+        specs.append((spec["chart"], args))
+    return specs
+
+
+def send_multipart(manifest: list[dict], filenames: list[str]):
+    boundary = uuid.uuid4().hex
+
+    # Read before the manifest is written, so a file evicted since its render is marked failed
+    cached_files = []
+    for entry, filename in zip(manifest, filenames):
+        if entry["status"] != "ready":
+            continue
+        try:
+            cached_files.append((entry, cache.read(filename)))
+        except FileNotFoundError:
+            cache.delete(filename)
+            entry["status"], entry["error"] = "failed", "Removed from the cache before it could be sent"
+
+    def parts():
+        yield f"--{boundary}\r\nContent-Type: application/json\r\n\r\n".encode() + json.dumps({"charts": manifest}).encode() + b"\r\n"
+        for entry, cached_file in cached_files:
+            yield (f"--{boundary}\r\nContent-Type: {cached_file.mimetype}\r\nContent-Location: {entry['url']}\r\n"
+                   f"ETag: \"{cached_file.etag}\"\r\nContent-Length: {cached_file.content_length}\r\n\r\n").encode() + cached_file.data + b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
+
+    return Response(b"".join(parts()), mimetype=f"multipart/mixed; boundary={boundary}")
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Status of a background render. ?wait=<seconds> long-polls until the job is finished
+    """
+    job = render_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    wait = min(parse_number(request.args, 'wait', float, default=0), max_job_wait)
+    if wait > 0:
+        render_queue.wait(job, wait)
+
+    return send_job(job, 200)
+
+
+
+## DATA ENDPOINTS
+
+@app.route('/data/orbit')
+def orbit_data():
+    args = request.args
+    input_planets = normalise_planets(args.getlist('planet'))
+    is_3d = args.get('is3d') == "true"
+    resolution, tolerance = parse_sampling(args)
 
+    parts = [planets_part(input_planets), "3d" if is_3d else "2d"] + sampling_parts(resolution, tolerance)
+    return send_data("orbit", parts, lambda: data().orbit_series(input_planets, is_3d, resolution, tolerance))
 
-@app.route('/angle_vs_time')
-def angle_vs_time():
+
+@app.route('/data/orbit_animation')
+def orbit_animation_data():
     args = request.args
-    input_planet = args.get('planet')
+    input_planets = normalise_planets(args.getlist('planet'))
+    is_3d = args.get('is3d') == "true"
 
-    prefix = "angle_vs_time-"
-    filename = prefix + input_planet + ".png"
+    duration, fps, max_frames, start = parse_animation_timing(args)
 
-    if cache.get(filename) is None:
-        generate_angle_vs_time(input_planet, filename)
-        cache.set(filename, True)
-    
-    return send_from_directory(directory='cache', path=filename, as_attachment=False)
+    parts = [planets_part(input_planets), "3d" if is_3d else "2d"] + timing_parts(duration, fps, max_frames, start)
+    return send_data("orbit_animation", parts, lambda: data().orbit_animation_series(input_planets, is_3d, duration, fps, max_frames, start))
 
 
-@app.route('/spinograph')
-def spinograph():
-    args = request.args
-    input_planets = args.getlist('planet')
+@app.route('/data/angle_vs_time')
+def angle_vs_time_data():
+    input_planet = normalise_planet(request.args.get('planet'))
 
-    assert len(input_planets) == 2
+    return send_data("angle_vs_time", [escape_name(input_planet)], lambda: data().angle_vs_time_series(input_planet))
 
-    prefix = "spinograph-"
-    filename = prefix + "_".join(input_planets) + ".png"
 
-    if cache.get(filename) is None:
-        generate_spinograph(input_planets, filename)
-        cache.set(filename, True)
-    
-    return send_from_directory(directory='cache', path=filename, as_attachment=False)
+@app.route('/data/spinograph')
+def spinograph_data():
+    args = request.args
+    input_planets = normalise_planets(args.getlist('planet'))
+    num_segments = parse_spinograph_segments(args)
 
+    if len(input_planets) != 2:
+        raise InvalidParameters("A spinograph needs two different planets")
 
-@app.route('/imaginary_orbit')
-def imaginary_orbit():
+    return send_data("spinograph", [planets_part(input_planets), str(num_segments)], lambda: data().spinograph_series(input_planets, num_segments))
+
+
+@app.route('/data/imaginary_orbit')
+def imaginary_orbit_data():
     args = request.args
-    centre_planet = args.get('centre')
-    input_planets = args.getlist('planet')
-    is_3d = args.get('is3d')
+    centre_planet = normalise_planet(args.get('centre'))
+    input_planets = normalise_planets(args.getlist('planet'))
+    is_3d = args.get('is3d') == "true"
+    resolution, span, step = parse_imaginary_times(args)
+
+    parts = [escape_name(centre_planet), planets_part(input_planets), "3d" if is_3d else "2d", str(resolution)] + time_span_parts(span, step)
+    return send_data("imaginary_orbit", parts, lambda: data().imaginary_orbit_series(centre_planet, input_planets, is_3d, resolution, span, step))
 
 
-    prefix = "imaginary_3d_anim-" if is_3d == "true" else "imaginary_2d_anim-"
-    filename = prefix + "_".join(input_planets) + ".png"
+if os.environ.get("BPHO_PRELOAD") == "1":
+    preload()
 
-    if cache.get(filename) is None:
-        generate_3d_imaginary_orbit(centre_planet, input_planets, filename) if is_3d == "true" else generate_2d_imaginary_orbit(centre_planet, input_planets, filename)
-        cache.set(filename, True)
-    
-    return send_from_directory(directory='cache', path=filename, as_attachment=False)
+startup_seconds = time.perf_counter() - startup_start
+print(f"App ready in {startup_seconds * 1000:.0f} ms")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,260 @@
+"""
+ASGI entry point, e.g.
+
+    uvicorn asgi:application --workers 2
+
+Cache hits of the chart endpoints are answered straight from the event loop, so they
+never wait behind a render. Cache misses are rendered in a bounded process pool; once
+max_pending_renders different files are pending, misses of other files are answered 503
+with Retry-After instead of queueing without limit, while requests for a file already
+pending wait for that render. Every other request (animation jobs, /batch, /data, /metrics...)
+runs the Flask app from app.py in a thread, so the same routes and handlers serve both
+this server and WSGI servers like gunicorn
+"""
+import asyncio
+import io
+import multiprocessing
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import request
+from werkzeug.exceptions import HTTPException
+
+from app import app, cache, charts, render_wait_timeout, is_not_modified, send_not_modified, send_file_bytes, send_saturated
+from cache_keys import InvalidParameters
+from metrics import metrics
+from render_queue import load_service
+
+# Processes rendering cache misses, and the most different files allowed to be rendering
+# or waiting for a render before misses of other files are answered 503
+render_processes = os.cpu_count() or 2
+max_pending_renders = 4 * render_processes
+
+# Endpoints whose cache misses are rendered in the process pool. Animations are too slow
+# to render inside a request and go to app.py's background render queue instead
+pool_rendered_charts = {"kepler_correlation", "orbit_image", "angle_vs_time", "spinograph", "imaginary_orbit"}
+
+render_pool = None
+pending_renders = {}  # cache key -> number of requests waiting for its render
+
+# Threads blocked on the process pool, so waiting renders never take the threads that run
+# the Flask app. Requests for a file already pending also take one while they wait
+render_waiters = ThreadPoolExecutor(max_workers=4 * max_pending_renders)
+
+metrics.gauge("pending_renders", lambda: len(pending_renders), "Files rendering or waiting for a render in the ASGI server's process pool")
+metrics.describe("render_rejections_total", "counter", "Cache misses answered 503 because the ASGI server's render pool was saturated")
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    # Started on first use. Spawned rather than forked since the server has threads running,
+    # and every process imports the plotting modules once when it starts
+    global render_pool
+    if render_pool is None:
+        render_pool = ProcessPoolExecutor(max_workers=render_processes, mp_context=multiprocessing.get_context("spawn"), initializer=load_service)
+    return render_pool
+
+
+def render_in_pool(render) -> None:
+    global render_pool
+    pool = get_render_pool()
+    try:
+        pool.submit(render).result()
+    except BrokenProcessPool:
+        # a render process died, e.g. killed for using too much memory, so start a new pool
+        # for the next render
+        if render_pool is pool:
+            render_pool = None
+        raise
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+    environ = make_environ(scope, body)
+    response = await send_chart(environ) if scope["method"] in ("GET", "HEAD") else None
+    if response is None:
+        response = await asyncio.get_running_loop().run_in_executor(None, call_wsgi_app, environ)
+
+    status, headers, response_body = response
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]})
+    await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else response_body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # load the cache index now, in a thread, rather than on the first request
+            await asyncio.get_running_loop().run_in_executor(None, cache.register_cache)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if render_pool is not None:
+                render_pool.shutdown(cancel_futures=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+## CHARTS
+
+async def send_chart(environ: dict):
+    """
+    Answers a chart endpoint from the cache, or renders a cache miss in the process pool.
+    Returns None for anything the Flask app should handle instead: other endpoints,
+    invalid parameters and animations that are not cached
+    """
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return None
+    if endpoint not in charts:
+        return None
+
+    with app.request_context(environ):
+        try:
+            app.preprocess_request()
+            filename, render = charts[endpoint](request.args)
+        except InvalidParameters:
+            return None
+
+        if is_not_modified(filename):
+            return finish_response(send_not_modified(filename))
+
+        cached_file = await read_cached(filename)
+        if cached_file is not None:
+            metrics.inc("cache_requests_total", result="hit")
+            return finish_response(send_file_bytes(cached_file))
+
+        if endpoint not in pool_rendered_charts:
+            return None
+
+        # Only renders of other files are limited, a request for a file already pending
+        # just waits for it
+        if filename not in pending_renders and len(pending_renders) >= max_pending_renders:
+            metrics.inc("render_rejections_total")
+            return finish_response(app.make_response(send_saturated()))
+
+        # Rendered through the cache, so a key is rendered once however many requests ask
+        # for it, whichever server they came through
+        pending_renders[filename] = pending_renders.get(filename, 0) + 1
+        try:
+            is_cached = await asyncio.get_running_loop().run_in_executor(
+                render_waiters, cache.get_or_render, filename, lambda: render_in_pool(render), render_wait_timeout)
+        except Exception:
+            traceback.print_exc()
+            return finish_response(app.make_response(("Render failed", 500)))
+        finally:
+            pending_renders[filename] -= 1
+            if not pending_renders[filename]:
+                del pending_renders[filename]
+
+        if not is_cached:
+            return finish_response(app.make_response(("Still rendering, please retry", 202, {"Retry-After": "5", "Cache-Control": "no-store"})))
+
+        cached_file = await read_cached(filename)
+        if cached_file is None:
+            # evicted or deleted between the render and now, let the Flask app render it again
+            return None
+        return finish_response(send_file_bytes(cached_file))
+
+
+async def read_cached(filename: str):
+    """
+    Returns the cached file, or None if it is not cached. Only the hot cache is looked at
+    on the event loop; the index, which takes the cache lock and is saved to disk now and
+    then, is only used from threads
+    """
+    loop = asyncio.get_running_loop()
+    cached_file = cache.hot.get(filename)
+    if cached_file is not None:
+        metrics.inc("hot_cache_requests_total", result="hit")
+        # record the access for the LRU eviction without waiting for it
+        loop.run_in_executor(None, cache.get, filename)
+        return cached_file
+
+    return await loop.run_in_executor(None, read_cached_file, filename)
+
+
+def read_cached_file(filename: str):
+    if cache.get(filename) is None:
+        return None
+    try:
+        return cache.read(filename)
+    except FileNotFoundError:
+        # the file was deleted from the cache folder behind the index's back
+        cache.delete(filename)
+        return None
+
+
+def finish_response(response) -> (int, list, bytes):
+    # Runs the after_request hooks (Server-Timing, Vary) as Flask would
+    response = app.process_response(response)
+    return response.status_code, list(response.headers.items()), response.get_data()
+
+
+## WSGI
+
+def make_environ(scope: dict, body: bytes) -> dict:
+    """
+    Returns the WSGI environ of an ASGI HTTP request
+    """
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        environ[name] = environ[name] + "," + value if name in environ else value
+    # the body has already been read whole, even if it was sent chunked
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+def call_wsgi_app(environ: dict) -> (int, list, bytes):
+    """
+    Runs the Flask app on a request and returns its status, headers and body
+    """
+    started = {}
+
+    def start_response(status: str, headers: list, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = headers
+
+    chunks = app.wsgi_app(environ, start_response)
+    try:
+        body = b"".join(chunks)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+    return started["status"], started["headers"], body
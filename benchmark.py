@@ -0,0 +1,200 @@
+"""
+Benchmarks every generator in bpho_service and the compute functions behind them
+
+    python benchmark.py [--repeat N] [--case SUBSTRING ...] [--output results.json]
+                        [--compare baseline.json] [--threshold 0.2]
+
+Every case is run --repeat times and the fastest wall and CPU times are kept. Peak memory
+is measured in one extra run under tracemalloc (Python and numpy allocations, not
+matplotlib's C++ buffers). With --compare the results are checked against an earlier
+run and the exit status is 1 if any case is more than --threshold slower, bigger in
+memory or bigger on disk
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import matplotlib
+import numpy as np
+
+from bpho_computation import OrbitSampling, build_orbit_geometry, adaptive_orbit_theta, get_animation_frames, calculate_animation_positions, calculate_angle_vs_time, calculate_spinograph_segments, calculate_imaginary_times, calculate_relative_orbits
+from bpho_service import dir_path, generate_kepler_correlation, generate_2d_orbit, generate_3d_orbit, generate_2d_orbit_animation, generate_3d_orbit_animation, generate_angle_vs_time, generate_spinograph, generate_2d_imaginary_orbit, generate_3d_imaginary_orbit
+from constants.data import get_planet
+
+inner_planets = ["Mercury", "Venus", "Earth", "Mars"]
+outer_planets = ["Jupiter", "Saturn", "Uranus", "Neptune", "Pluto"]
+
+# Representative planet sets: one, a few and all of the inner and of the outer planets
+planet_sets = [inner_planets[:1], inner_planets[:2], inner_planets, outer_planets[:1], outer_planets[:3], outer_planets]
+
+# Differences smaller than these are noise and never count as regressions
+min_wall_seconds = 0.005
+min_peak_bytes = 64 * 1024
+
+# Benchmark files are dotfiles, which the cache index never registers, and are deleted
+# after every run
+cache_dir = os.path.join(dir_path, "cache")
+
+
+## CASES
+
+def set_name(planets: list[str]) -> str:
+    return "_".join(planets)
+
+
+def generator_cases() -> list[tuple]:
+    """
+    Every (name, generator, args, extension) to benchmark. The generators are called
+    with args plus a filename
+    """
+    cases = [("generate_kepler_correlation", generate_kepler_correlation, (), "png")]
+
+    for planets in planet_sets:
+        cases.append((f"generate_2d_orbit[{set_name(planets)}]", generate_2d_orbit, (planets,), "png"))
+        cases.append((f"generate_3d_orbit[{set_name(planets)}]", generate_3d_orbit, (planets,), "png"))
+        cases.append((f"generate_2d_orbit_animation[{set_name(planets)}]", generate_2d_orbit_animation, (planets,), "gif"))
+        cases.append((f"generate_3d_orbit_animation[{set_name(planets)}]", generate_3d_orbit_animation, (planets,), "gif"))
+
+    for planet in ["Mercury", "Pluto"]:
+        cases.append((f"generate_angle_vs_time[{planet}]", generate_angle_vs_time, (planet,), "png"))
+
+    for planets in [["Venus", "Earth"], ["Earth", "Pluto"]]:
+        cases.append((f"generate_spinograph[{set_name(planets)}]", generate_spinograph, (planets,), "png"))
+
+    for planets in [["Mars"], ["Mercury", "Venus", "Mars"], outer_planets]:
+        cases.append((f"generate_2d_imaginary_orbit[Earth-{set_name(planets)}]", generate_2d_imaginary_orbit, ("Earth", planets), "png"))
+        cases.append((f"generate_3d_imaginary_orbit[Earth-{set_name(planets)}]", generate_3d_imaginary_orbit, ("Earth", planets), "png"))
+
+    return cases
+
+
+def compute_cases() -> list[tuple]:
+    """
+    Every (name, function, args) to benchmark, without any drawing
+    """
+    cases = []
+    for planets in planet_sets:
+        planets = [get_planet(_) for _ in planets]
+        name = set_name(planet.name for planet in planets)
+        cases.append((f"build_orbit_geometry[{name}]", build_orbit_geometry, (planets,)))
+        num_frames, frame_step, start_frame, _ = get_animation_frames(planets)
+        for is_3d in (False, True):
+            cases.append((f"calculate_animation_positions[{name}-{'3d' if is_3d else '2d'}]", calculate_animation_positions, (planets, is_3d, num_frames, frame_step, start_frame)))
+        cases.append((f"calculate_relative_orbits[Earth-{name}]", lambda planets: calculate_relative_orbits(get_planet("Earth"), planets, True, calculate_imaginary_times(get_planet("Earth"), planets)), (planets,)))
+
+    for planet in ["Mercury", "Pluto"]:
+        cases.append((f"adaptive_orbit_theta[{planet}]", adaptive_orbit_theta, (get_planet(planet), OrbitSampling(tolerance=1e-4))))
+        cases.append((f"calculate_angle_vs_time[{planet}]", calculate_angle_vs_time, (get_planet(planet),)))
+
+    for planets in [["Venus", "Earth"], ["Earth", "Pluto"]]:
+        cases.append((f"calculate_spinograph_segments[{set_name(planets)}]", calculate_spinograph_segments, ([get_planet(_) for _ in planets], False)))
+
+    return cases
+
+
+## RUNNER
+
+def measure(run, repeat: int) -> dict:
+    """
+    Times run() repeat times, then runs it once more under tracemalloc for its peak memory
+    """
+    wall, cpu = [], []
+    for _ in range(repeat):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        run()
+        wall.append(time.perf_counter() - wall_start)
+        cpu.append(time.process_time() - cpu_start)
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"wall_seconds": min(wall), "cpu_seconds": min(cpu), "peak_bytes": peak_bytes}
+
+
+def run_benchmarks(repeat: int = 3, case_filters: list[str] = None) -> dict:
+    def is_selected(name: str) -> bool:
+        return case_filters is None or any(case_filter in name for case_filter in case_filters)
+
+    results = {}
+    for name, generator, args, extension in generator_cases():
+        if not is_selected(name):
+            continue
+
+        filename = ".benchmark." + extension
+        try:
+            result = measure(lambda: generator(*args, filename), repeat)
+            result["output_bytes"] = os.path.getsize(os.path.join(cache_dir, filename))
+        finally:
+            if os.path.exists(os.path.join(cache_dir, filename)):
+                os.remove(os.path.join(cache_dir, filename))
+        results[name] = result
+        print_result(name, result)
+
+    for name, function, args in compute_cases():
+        if not is_selected(name):
+            continue
+
+        results[name] = measure(lambda: function(*args), repeat)
+        print_result(name, results[name])
+
+    return {"meta": {"python": platform.python_version(), "numpy": np.__version__, "matplotlib": matplotlib.__version__,
+                     "machine": platform.machine(), "processor": platform.processor(), "repeat": repeat, "time": time.time()},
+            "results": results}
+
+
+def print_result(name: str, result: dict) -> None:
+    output = f" {result['output_bytes'] / 1024:9.1f} KB" if "output_bytes" in result else ""
+    print(f"{name:70} {result['wall_seconds'] * 1000:9.1f} ms wall {result['cpu_seconds'] * 1000:9.1f} ms cpu {result['peak_bytes'] / 1024 ** 2:7.1f} MB peak{output}")
+
+
+## COMPARISON
+
+def compare_results(baseline: dict, current: dict, threshold: float) -> list[str]:
+    """
+    Returns a description of every case of current that is more than threshold (a
+    fraction) worse than in baseline. Cases missing from either run are skipped
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+
+        for metric, noise in (("wall_seconds", min_wall_seconds), ("peak_bytes", min_peak_bytes), ("output_bytes", 0)):
+            if metric not in result or metric not in old:
+                continue
+            if result[metric] > old[metric] * (1 + threshold) and result[metric] - old[metric] > noise:
+                regressions.append(f"{name} {metric}: {old[metric]:.6g} -> {result[metric]:.6g} ({result[metric] / old[metric] - 1:+.0%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the generators and compute functions")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case, the fastest is kept (default: 3)")
+    parser.add_argument("--case", action="append", dest="cases", help="only run cases whose name contains this, may be repeated")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown or growth as a fraction (default: 0.2)")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.repeat, args.cases)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare_results(json.load(baseline_file), results, args.threshold)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        print(f"{len(regressions)} regressions above {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
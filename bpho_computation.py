@@ -1,19 +1,33 @@
 # BPhO Computational Challenge 2023
 # Challenges 1 - 7
 
-from dataclasses import dataclass
-import matplotlib.pyplot as plt
-from constants.data import Planet
-from matplotlib.animation import FuncAnimation
+from collections import OrderedDict
+from dataclasses import astuple, dataclass
+from threading import Lock
+from constants.data import Planet, retrieve_planet_details
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
 import numpy as np
-from scipy.interpolate import interp1d
 
 
 @dataclass
-class PlanetCoordinates:
-    x: float
-    y: float
-    z: float
+class OrbitSampling:
+    num_points: int = None  # points per orbit path
+    tolerance: float = None  # largest gap between the drawn path and the orbit, as a fraction of a
+
+    def is_default(self) -> bool:
+        return self.num_points is None and self.tolerance is None
+
+
+@dataclass
+class AnimationTiming:
+    duration: float = None  # seconds of playback, by default one orbit of the slowest planet at one (modified) year per second
+    fps: float = 15  # frames per second of playback
+    max_frames: int = None  # frame budget, longer animations are subsampled to fit
+    start: float = 0  # (modified) years at the first frame
+
+    def is_default(self) -> bool:
+        return self.duration is None and self.fps == 15 and self.max_frames is None and self.start == 0
 
 
 ## GRAPH FUNCTIONS
@@ -31,44 +45,183 @@ def plot_centre(centre_planet_name: str, axis) -> None: #TODO
 ## ORBIT FUNCTIONS
 
 # Calculate the elliptical orbits of each planet
-def calculate_orbit_position(planet: Planet, theta, orbit_3D) -> PlanetCoordinates:
+def calculate_orbit_positions(planets: list[Planet], theta, orbit_3D: bool) -> (np.ndarray, np.ndarray, np.ndarray):
     """
-    Calculates the x and y coordinates of the orbit of a planet at a given angle theta
+    Calculates the x, y and z coordinates of the orbits of many planets at once.
+    theta is either one array of angles shared by every planet or an array with
+    one row per planet. The coordinates are returned as (planets, samples) arrays
     """
-
-    def compute_r(a: float, ecc: float, theta: float):
-        """
-        Computes the radius of the orbit at a given angle theta
-        """
-        return (a*(1-ecc**2))/(1-ecc*np.cos(theta))
+    a = np.array([planet.a for planet in planets])[:, np.newaxis]
+    ecc = np.array([planet.ecc for planet in planets])[:, np.newaxis]
+    beta = np.array([planet.beta for planet in planets])[:, np.newaxis] * np.pi / 180
+    theta = np.broadcast_to(np.asarray(theta, dtype=float), (len(planets), np.shape(theta)[-1]))
 
     # Calculate r
-    r = compute_r(planet.a, planet.ecc, theta)
+    r = (a*(1-ecc**2))/(1-ecc*np.cos(theta))
 
-    # Calculate x coordinate
+    # Calculate x and y coordinates
     x = r * np.cos(theta)
-
-    # Calculate y coordinate
     y = r * np.sin(theta)
 
     # If 3D orbits are to be calculated
-    x = x * np.cos(planet.beta * np.pi / 180) if orbit_3D else x
-    z = x * np.sin(planet.beta * np.pi / 180) if orbit_3D else None
+    x = x * np.cos(beta) if orbit_3D else x
+    z = x * np.sin(beta) if orbit_3D else None
+
+    return x, y, z
+
+
+def calculate_orbit_positions_at_time(planets: list[Planet], t, orbit_3D: bool) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Calculates the coordinates of many planets at the times t (years), where every
+    planet moves with a constant angular speed of 2 * pi / P
+    """
+    p = np.array([planet.p for planet in planets])[:, np.newaxis]
+    theta = (2 * np.pi * np.asarray(t, dtype=float)) / p
+    return calculate_orbit_positions(planets, theta, orbit_3D)
+
+
+def calculate_angle_at_time(t, P: float, ecc: float, theta0: float = 0) -> np.ndarray:
+    """
+    Calculates the polar angle of an orbit at the times t (years) by solving
+    Kepler's equation M = E - ecc * sin(E) with a vectorized Newton iteration.
+    The angle theta0 at t = 0 is measured the same way as in calculate_orbit_positions,
+    so the perihelion is at theta = pi
+    """
+    # Eccentric anomaly and mean anomaly at t = 0
+    nu0 = theta0 - np.pi
+    E0 = 2 * np.arctan2(np.sqrt(1 - ecc) * np.sin(nu0 / 2), np.sqrt(1 + ecc) * np.cos(nu0 / 2))
+    M = (E0 - ecc * np.sin(E0)) + 2 * np.pi * np.asarray(t, dtype=float) / P
+
+    # Newton iteration on the eccentric anomaly
+    E = M + ecc * np.sin(M)
+    for _ in range(50):
+        dE = (E - ecc * np.sin(E) - M) / (1 - ecc * np.cos(E))
+        E = E - dE
+        if np.max(np.abs(dE), initial=0) < 1e-14:
+            break
+
+    # Convert the eccentric anomaly to the polar angle without wrapping it to (-pi, pi]
+    beta = ecc / (1 + np.sqrt(1 - ecc ** 2))
+    nu = E + 2 * np.arctan2(beta * np.sin(E), 1 - beta * np.cos(E))
+
+    return nu + np.pi
+
+
+## ORBIT GEOMETRY
+
+# Angles of the 1000 points sampled along every orbit path drawn by plot_orbit
+orbit_path_theta = np.arange(1000) * (0.002*np.pi)
+
 
-    return PlanetCoordinates(x, y, z)
+def build_orbit_geometry(planets: list[Planet]) -> dict:
+    """
+    Samples the 2D and 3D orbit paths of the planets. Returns a dictionary of
+    planet name -> (planet, {is_3D_orbit: (x, y, z)}), where the arrays are read-only
+    so they can be shared by every render
+    """
+    geometry = {planet.name: (planet, {}) for planet in planets}
+    for is_3D_orbit in (False, True):
+        orbit_x, orbit_y, orbit_z = calculate_orbit_positions(planets, orbit_path_theta, is_3D_orbit)
+        for array in (orbit_x, orbit_y, orbit_z):
+            if array is not None:
+                array.flags.writeable = False
+
+        for index, planet in enumerate(planets):
+            geometry[planet.name][1][is_3D_orbit] = (orbit_x[index], orbit_y[index], orbit_z[index] if is_3D_orbit else None)
+
+    return geometry
+
+
+# Orbit paths of every planet in constants/data.py, built once at import
+orbit_geometry = build_orbit_geometry(retrieve_planet_details())
+
+# Other orbit paths (catalogue bodies, non-default samplings) are kept once computed, so
+# charts of the same planets share them. Least recently used first
+computed_orbit_paths = OrderedDict()
+computed_orbit_paths_lock = Lock()
+max_computed_orbit_paths = 256
+
+
+def adaptive_orbit_theta(planet: Planet, sampling: OrbitSampling) -> np.ndarray:
+    """
+    Places points along an orbit so the straight lines between them stray from the orbit
+    by the same distance everywhere, which puts more points near the perihelion of an
+    eccentric orbit. The number of points is either sampling.num_points, or the fewest
+    that keep that distance below sampling.tolerance * a
+    """
+    # Curvature k and arc length s of r(theta) on a fine grid
+    theta = np.linspace(0, 2 * np.pi, 4097)
+    a, ecc = planet.a, planet.ecc
+    semi_latus_rectum = a*(1-ecc**2)
+    r = semi_latus_rectum/(1-ecc*np.cos(theta))
+    dr = -ecc * np.sin(theta) * r**2 / semi_latus_rectum
+    d2r = 2 * dr**2 / r - ecc * np.cos(theta) * r**2 / semi_latus_rectum
+    ds = np.sqrt(r**2 + dr**2)
+    k = np.abs(r**2 + 2 * dr**2 - r * d2r) / ds**3
+
+    # A line of length L across a curve of curvature k strays k * L^2 / 8 from it, so the
+    # gap is the same everywhere when points are spaced evenly in the integral of sqrt(k) ds
+    density = np.sqrt(k) * ds
+    cumulative = np.concatenate(([0], np.cumsum((density[1:] + density[:-1]) / 2 * np.diff(theta))))
+
+    num_points = sampling.num_points
+    if num_points is None:
+        num_points = int(np.ceil(cumulative[-1] / np.sqrt(8 * sampling.tolerance * a)))
+    num_points = max(num_points, 8)
+
+    return np.interp(np.linspace(0, cumulative[-1], num_points, endpoint=False), cumulative, theta)
+
+
+def get_orbit_paths(planets: list[Planet], is_3D_orbit: bool, sampling: OrbitSampling = None) -> list[tuple]:
+    """
+    Returns the (x, y, z) orbit path of every planet, from orbit_geometry or
+    computed_orbit_paths where possible. Paths with a non-default sampling are placed by
+    adaptive_orbit_theta
+    """
+    is_default = sampling is None or sampling.is_default()
+
+    def is_stored(planet: Planet) -> bool:
+        return is_default and planet.name in orbit_geometry and orbit_geometry[planet.name][0] == planet
+
+    paths = []
+    for planet in planets:
+        if is_stored(planet):
+            paths.append(orbit_geometry[planet.name][1][is_3D_orbit])
+            continue
+
+        key = (astuple(planet), is_3D_orbit, None if is_default else (sampling.num_points, sampling.tolerance))
+        with computed_orbit_paths_lock:
+            path = computed_orbit_paths.get(key)
+            if path is not None:
+                computed_orbit_paths.move_to_end(key)
+
+        if path is None:
+            theta = orbit_path_theta if is_default else adaptive_orbit_theta(planet, sampling)
+            x, y, z = calculate_orbit_positions([planet], theta, is_3D_orbit)
+            path = (x[0], y[0], z[0] if is_3D_orbit else None)
+            for array in path:
+                if array is not None:
+                    array.flags.writeable = False
+
+            with computed_orbit_paths_lock:
+                computed_orbit_paths[key] = path
+                while len(computed_orbit_paths) > max_computed_orbit_paths:
+                    computed_orbit_paths.popitem(last=False)
+        paths.append(path)
+    return paths
 
 
 # Task 1 - 2D
-def kepler_correlation(planets: list[Planet]) -> None:
+def kepler_correlation(planets: list[Planet], ax) -> None:
     """
     Plots the Kepler's Third Law correlation
     """
 
     def plot_kepler_correlation():
-        plt.plot(x, y, marker="s", markerfacecolor="red", markeredgecolor="red", label="Kepler's Third Law")
-        plt.title("Kepler's Third Law")
-        plt.xlabel("(a/AU)^(3/2)")
-        plt.ylabel("T/Yr")
+        ax.plot(x, y, marker="s", markerfacecolor="red", markeredgecolor="red", label="Kepler's Third Law")
+        ax.set_title("Kepler's Third Law")
+        ax.set_xlabel("(a/AU)^(3/2)")
+        ax.set_ylabel("T/Yr")
     
 
     x = []
@@ -82,7 +235,7 @@ def kepler_correlation(planets: list[Planet]) -> None:
 
 # Task 2 - 2D
 
-def plot_orbit(input_planets: list[Planet], has_sun: bool, is_3D_orbit: bool, ax) -> None:
+def plot_orbit(input_planets: list[Planet], has_sun: bool, is_3D_orbit: bool, ax, sampling: OrbitSampling = None) -> None:
 
     def plot_planet(planet: Planet, ax, is_3D_orbit):
         if is_3D_orbit:
@@ -100,106 +253,91 @@ def plot_orbit(input_planets: list[Planet], has_sun: bool, is_3D_orbit: bool, ax
         ax.set_ylabel("y/AU")
 
 
-    for input_planet in input_planets:
-        x = []
-        y = []
-        z = []
-        theta = 0
-        for _ in range(1000):
-            coord = calculate_orbit_position(input_planet, theta, is_3D_orbit)
-            x.append(coord.x)
-            y.append(coord.y)
-
-            if is_3D_orbit:
-                z.append(coord.z)
-
-            # Increase theta
-            theta += (0.002*np.pi)
-
+    # With the default sampling the orbit paths are sampled once at import
+    for input_planet, (x, y, z) in zip(input_planets, get_orbit_paths(input_planets, is_3D_orbit, sampling)):
         plot_planet(input_planet, ax, is_3D_orbit)
     plot_sun(has_sun, ax)
     set_labels()
     
 
-def animate_orbit(input_planets: list[Planet], orbit_3D: bool, ax, fig, colours: list[str]):
-
-    def animate(i: int, input_planets: list[Planet], markers: list[plt.Line2D]) -> list[plt.Line2D]:
-        """
-        Animate the markers for the animation
-        """
-        for index, input_planet in enumerate(input_planets):
-            #theta = (2 * np.pi * (i * 0.002)) / input_planet.modified_p
-            # Earth and Jupiter should turn one full rotation in 60 frames
-            num_frames = 15 * input_planet.modified_p
-            theta = (2 * np.pi * ((i % num_frames) / num_frames))
-            planet_coord = calculate_orbit_position(input_planet, theta, orbit_3D)
-
-            markers[index].set_data(planet_coord.x, planet_coord.y)
-
-            if orbit_3D:
-                markers[index].set_3d_properties(planet_coord.z)
-                
-        return markers
-
-    def get_markers(ax):
-        # CREATE THE MARKERS FOR THE ANIMATIONS
-        if orbit_3D:
-            markers = [ax.plot([0], [0], [0], marker = "o", color = colours[_])[0] for _ in range(9)]
-        else:
-            markers = [ax.plot([0], [0], marker = "o", color = colours[_])[0] for _ in range(9)]
-        
-        return markers
+# Every animation is subsampled to at most this many frames, whatever its timing. The
+# frames of an animation are all held in memory until it is encoded (about 1 MB each at
+# 800x800), so this bounds a render's memory. The slowest solar system animation, of
+# Pluto, has 315 frames
+max_animation_frames = 320
 
-    def init():
-        """
-        Initialise the markers for the animation
-        """
-        markers = get_markers(ax)
-        for marker in markers:
-            marker.set_data([], [])
 
-        return markers
+# Shortest frame delay (seconds) written to the image formats, since browsers play GIF
+# frames of 10 ms or less at 100 ms
+min_frame_delay = 0.02
 
-    plot_orbit(input_planets, True, orbit_3D, ax)
-    final_frames = 15 * input_planets[-1].modified_p
-    final_frames = int(np.ceil(final_frames))
-    return FuncAnimation(fig, animate, frames = final_frames, init_func = init,
-                                fargs = (input_planets, get_markers(ax)), interval = 1, blit = True)
 
+def get_animation_frames(input_planets: list[Planet], timing: AnimationTiming = None, delay_step: float = None) -> (int, float, float, float):
+    """
+    Returns the number of frames, the step between frames and the first frame (both in
+    frames of the default animation, which are 1/15 of a modified year apart) and the
+    playback fps. The animation always shows one orbit of the slowest planet, stretched
+    over the duration. If that needs more frames than the budget, every n-th frame is
+    kept and the fps is lowered so the duration stays the same.
+    delay_step is the unit (seconds) of the frame delays the output format stores, e.g.
+    0.01 for GIF. If given, the fps is moved to the nearest one whose delay is a whole
+    number of steps and at least min_frame_delay, and the frames are counted at that fps,
+    so the written delays play for the requested duration
+    """
+    timing = timing or AnimationTiming()
+    slowest_p = max(planet.modified_p for planet in input_planets)
+    duration = slowest_p if timing.duration is None else timing.duration
 
-# Task 5
-def angle_vs_time(ax, input_planet: Planet) -> None:
+    max_frames = max_animation_frames if timing.max_frames is None else min(timing.max_frames, max_animation_frames)
 
-    def calculate_angle_vs_time(t, P, ecc, theta0) -> np.ndarray:
+    def stored_fps(fps: float, round_steps) -> float:
+        if delay_step is None:
+            return fps
+        # the small offset keeps float error from adding a step to exact delays
+        steps = max(round_steps(1 / (fps * delay_step) - 1e-9), int(np.ceil(min_frame_delay / delay_step - 1e-9)))
+        return 1 / (steps * delay_step)
 
-        # Angle step for Simpson's rule
-        dtheta = 1/1000
+    fps = stored_fps(timing.fps, round)
+    num_frames = int(np.ceil(duration * fps))
+    if num_frames > max_frames:
+        # a delay rounded up keeps the frames within the budget
+        fps = stored_fps(max_frames / duration, np.ceil)
+        num_frames = min(int(np.ceil(duration * fps)), max_frames)
 
-        # Number of orbits
-        N = np.ceil(t[-1] / P)
-        
-        # Define array of polar angles for orbits
-        theta = np.arange(theta0, (2 * np.pi * N + theta0) + dtheta, dtheta)
+    frame_step = (15 * slowest_p) / (duration * fps)
+    return num_frames, frame_step, 15 * timing.start, fps
 
-        # Evaluate integrand of time integral
-        f = (1 - ecc * np.cos(theta)) ** (-2)
 
-        # Define Simpson rule coefficients c = [1, 4, 2, 4, 2, 4, ....1]
-        L = len(theta)
-        isodd = np.remainder(np.arange(1, L-1), 2)
-        isodd[isodd == 1] = 4
-        isodd[isodd == 0] = 2
-        c = np.concatenate(([1], isodd, [1]))
+def calculate_animation_positions(input_planets: list[Planet], orbit_3D: bool, num_frames: int, frame_step: float = 1.0, start_frame: float = 0.0) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Calculates the marker position of every planet in every frame of an orbit animation,
+    returned as (planets, frames) arrays
+    """
+    # Earth and Jupiter should turn one full rotation in 15 frames
+    planet_frames = 15 * np.array([planet.modified_p for planet in input_planets])[:, np.newaxis]
+    i = start_frame + np.arange(num_frames) * frame_step
+    theta = 2 * np.pi * ((i % planet_frames) / planet_frames)
+    return calculate_orbit_positions(input_planets, theta, orbit_3D)
 
-        # Calculate array of times
-        tt = P * ((1 - ecc ** 2) ** (3/2)) * (1 / (2 * np.pi)) * dtheta * (1 / 3) * np.cumsum(c * f)
 
-        # Interpolate the polar angles for the eccentric orbit at the circular orbit times
-        theta = interp1d(tt, theta, kind='cubic')
-        theta = theta(t)
-        
-        return theta
-    
+def plot_animation_markers(input_planets: list[Planet], orbit_3D: bool, ax, colours: list[str], sampling: OrbitSampling = None) -> list[Line2D]:
+    """
+    Plots the orbits and creates one animated marker per planet. Animated markers are
+    left out of a normal draw, so the orbits can be rasterised once as a background
+    """
+    plot_orbit(input_planets, True, orbit_3D, ax, sampling)
+
+    if orbit_3D:
+        markers = [ax.plot([], [], [], marker = "o", color = colours[index % len(colours)], animated = True)[0] for index in range(len(input_planets))]
+    else:
+        markers = [ax.plot([], [], marker = "o", color = colours[index % len(colours)], animated = True)[0] for index in range(len(input_planets))]
+
+    return markers
+
+
+# Task 5
+def angle_vs_time(ax, input_planet: Planet) -> None:
+
     def plot_angle_vs_time(ax):
         ax.cla()
         ax.plot(t, theta_circ, label = "Circular")
@@ -208,76 +346,52 @@ def angle_vs_time(ax, input_planet: Planet) -> None:
         ax.set_ylabel("orbit polar angle/rad")
 
 
+    t, theta_circ, theta_ecc = calculate_angle_vs_time(input_planet)
+
+    plot_angle_vs_time(ax)
+
+
+def calculate_angle_vs_time(input_planet: Planet) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Calculates the polar angle of a circular and of the eccentric orbit over 800 years
+    """
     t = np.linspace(1, 800, 800)
 
-    theta_circ = calculate_angle_vs_time(t, input_planet.p, 0, 0)
-    theta_ecc = calculate_angle_vs_time(t, input_planet.p, input_planet.ecc, 0)
+    theta_circ = calculate_angle_at_time(t, input_planet.p, 0, 0)
+    theta_ecc = calculate_angle_at_time(t, input_planet.p, input_planet.ecc, 0)
 
-    plot_angle_vs_time(ax)
+    return t, theta_circ, theta_ecc
 
 
 # Task 6
-def plot_spinograph(input_planets: list[Planet], is_3D_orbit: bool, ax) -> None:
-    planet1 = input_planets[0]
-    planet2 = input_planets[1]
-    tmax = max([planet1.p, planet2.p])  # Max time /years
-    dt = 10 * tmax / 1234  # Time interval in years
-    t = 0
+def plot_spinograph(input_planets: list[Planet], is_3D_orbit: bool, ax, num_segments: int = 1234, sampling: OrbitSampling = None) -> None:
+    x, y = calculate_spinograph_segments(input_planets, is_3D_orbit, num_segments)
 
-    while t < 10 * tmax:
-        x = []
-        y = []
+    # Every connecting line goes from planet 1 to planet 2, shape (steps, 2, 2)
+    segments = np.stack((x.T, y.T), axis = -1)
+    ax.add_collection(LineCollection(segments, colors = "black", linewidths = 0.5))
+    ax.autoscale_view()
 
-        theta = (2 * np.pi * (t)) / planet1.p
-        planet_coord = calculate_orbit_position(planet1, theta, is_3D_orbit)
-        x.append(planet_coord.x)
-        y.append(planet_coord.y)
+    plot_orbit(input_planets, False, False, ax, sampling)
 
-        theta = (2* np.pi * (t)) / planet2.p
-        planet_coord = calculate_orbit_position(planet2, theta, is_3D_orbit)
-        x.append(planet_coord.x)
-        y.append(planet_coord.y)
-        
-        ax.plot(x, y, color = "black", linewidth = 0.5)
-        #Update time t /years
-        t = t + dt
 
-    plot_orbit(input_planets, False, False, ax)
+def calculate_spinograph_segments(input_planets: list[Planet], is_3D_orbit: bool, num_segments: int = 1234) -> (np.ndarray, np.ndarray):
+    """
+    Calculates the positions of both planets at every time step over 10 periods of the
+    slower planet, returned as (2, steps) arrays
+    """
+    planet1 = input_planets[0]
+    planet2 = input_planets[1]
+    tmax = max([planet1.p, planet2.p])  # Max time /years
+    dt = 10 * tmax / num_segments  # Time interval in years
+    t = np.arange(num_segments) * dt
+
+    x, y, _ = calculate_orbit_positions_at_time([planet1, planet2], t, is_3D_orbit)
+    return x, y
 
 
 # Task 7
-def plot_imaginary_orbit(input_centre_planet: Planet, input_planets: list[Planet], is_3D_orbit: bool, ax) -> None:
-
-    def calculate_planet_orbit(centre_planet: Planet, 
-                                planet: Planet
-                                ) -> (list[float], list[float], list[float]):
-        
-        # Calculate the position of planet 1 (eg. Earth, which will be at the centre of the solar system)
-        coord_x = []
-        coord_y = []
-        coord_z = []
-            
-        tmax = max([centre_planet.p, planet.p])  # Max time /years
-        dt = 10*tmax/1234  # Time interval in years
-        t = 0
-
-        for _ in range(1000):
-
-            theta = (2 * np.pi * (t)) / centre_planet.p
-            planet1 = calculate_orbit_position(centre_planet, theta, is_3D_orbit)
-            
-            theta = (2 * np.pi * (t)) / planet.p
-            planet2 = calculate_orbit_position(planet, theta, is_3D_orbit)
-            
-            coord_x.append(planet2.x - planet1.x)
-            coord_y.append(planet2.y - planet1.y)
-            
-            if is_3D_orbit:
-                coord_z.append(planet2.z - planet1.z)
-            
-            # Update time t /years
-            t = t + dt
-        return coord_x, coord_y, coord_z
+def plot_imaginary_orbit(input_centre_planet: Planet, input_planets: list[Planet], is_3D_orbit: bool, ax, num_steps: int = 1000, span: float = None, step: float = None) -> None:
 
     def set_labels(is_3D_orbit: bool):
         ax.set_xlabel("x/AU")
@@ -288,13 +402,50 @@ def plot_imaginary_orbit(input_centre_planet: Planet, input_planets: list[Planet
     # Plot the centre planet
     plot_centre(input_centre_planet.name, ax)
 
-    # Plot the orbits of the other planets
-    for planet in input_planets:
-        coord_x, coord_y, coord_z = calculate_planet_orbit(input_centre_planet, planet)
-
+    # Plot the orbits of the other planets, all calculated in one pass
+    t = calculate_imaginary_times(input_centre_planet, input_planets, num_steps, span, step)
+    coord_x, coord_y, coord_z = calculate_relative_orbits(input_centre_planet, input_planets, is_3D_orbit, t)
+    for index, planet in enumerate(input_planets):
         if is_3D_orbit:
-            ax.plot(coord_x, coord_y, coord_z, label = planet.name)
+            ax.plot(coord_x[index], coord_y[index], coord_z[index], label = planet.name)
         else:
-            ax.plot(coord_x, coord_y, label = planet.name)
+            ax.plot(coord_x[index], coord_y[index], label = planet.name)
     
-    set_labels(is_3D_orbit)
\ No newline at end of file
+    set_labels(is_3D_orbit)
+
+
+def calculate_imaginary_times(centre_planet: Planet, planets: list[Planet], num_steps: int = 1000, span: float = None, step: float = None) -> np.ndarray:
+    """
+    Calculates the times (years) at which the imaginary orbits are sampled. By default
+    every planet gets num_steps steps of 10 * max(P_centre, P) / 1234 years, as a
+    (planets, steps) array. Given a span (years), every planet shares one array of
+    times from 0 to span, either step years apart or split into num_steps steps
+    """
+    if span is None:
+        tmax = np.maximum(centre_planet.p, np.array([planet.p for planet in planets]))[:, np.newaxis]  # Max time /years
+        dt = 10*tmax/1234  # Time interval in years
+        return np.arange(num_steps) * dt
+
+    if step is not None:
+        return np.arange(int(np.floor(span / step)) + 1) * step
+    return np.linspace(0, span, num_steps)
+
+
+def calculate_relative_orbits(centre_planet: Planet, planets: list[Planet], is_3D_orbit: bool, t) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Calculates the orbits of the planets relative to the centre planet at the times t,
+    either one array of times shared by every planet or one row per planet. The centre
+    planet's trajectory is calculated once and subtracted from every planet's, giving
+    (planets, steps) arrays
+    """
+    t = np.asarray(t, dtype=float)
+
+    # Position of the centre planet (eg. Earth, which will be at the centre of the solar system)
+    centre_x, centre_y, centre_z = calculate_orbit_positions_at_time([centre_planet], t.reshape(1, -1), is_3D_orbit)
+    x, y, z = calculate_orbit_positions_at_time(planets, t, is_3D_orbit)
+
+    coord_x = x - centre_x.reshape(t.shape)
+    coord_y = y - centre_y.reshape(t.shape)
+    coord_z = z - centre_z.reshape(t.shape) if is_3D_orbit else None
+
+    return coord_x, coord_y, coord_z
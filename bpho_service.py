@@ -1,126 +1,184 @@
+import io
 import os
+import uuid
+from contextlib import contextmanager
+from fractions import Fraction
+from threading import Lock
 import matplotlib as mpl
 mpl.use('Agg')
-import matplotlib.pyplot as plt
-from matplotlib.animation import PillowWriter
-
-from bpho_computation import kepler_correlation, plot_orbit, animate_orbit, angle_vs_time, plot_spinograph, plot_imaginary_orbit
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import to_rgb
+from matplotlib.figure import Figure
+from matplotlib.image import imsave
+from mpl_toolkits.mplot3d import proj3d
+import numpy as np
+from PIL import Image
+
+from bpho_computation import OrbitSampling, AnimationTiming, kepler_correlation, plot_orbit, angle_vs_time, plot_spinograph, plot_imaginary_orbit, get_animation_frames, calculate_animation_positions, plot_animation_markers
 from constants.data import retrieve_planet_details, get_planet
 from constants.colours import get_colours
+from formats import still_formats, animation_formats
+from metrics import stage
 
 dir_path = os.path.abspath(os.path.dirname(__file__))
 
 
 #Task 1
-def generate_kepler_correlation(filename: str):
+def generate_kepler_correlation(filename: str, image_format: str = "png"):
     fig, ax = figure_setup(is_3D_orbit=False)
-    kepler_correlation(retrieve_planet_details())
-    finish_figure(ax, "Kepler's Third Law")
+    with stage("plot"):
+        kepler_correlation(retrieve_planet_details(), ax)
+        finish_figure(ax, "Kepler's Third Law")
 
-    fig.savefig(os.path.join(dir_path, "cache", filename))
-    close_figure()
+    save_figure(fig, filename, image_format)
+    close_figure(fig)
 
 
 # Task 2A
-def generate_2d_orbit(input_planets: list[str], filename: str):
+def generate_2d_orbit(input_planets: list[str], filename: str, resolution: int = None, tolerance: float = None, image_format: str = "png"):
     fig, ax = figure_setup(is_3D_orbit=False)
-    input_planets = [get_planet(_) for _ in input_planets]
-    plot_orbit(input_planets, True, False, ax)
-    finish_figure(ax, "2D Planet Orbits")
+    with stage("plot"):
+        input_planets = [get_planet(_) for _ in input_planets]
+        plot_orbit(input_planets, True, False, ax, OrbitSampling(resolution, tolerance))
+        finish_figure(ax, "2D Planet Orbits")
 
-    fig.savefig(os.path.join(dir_path, "cache", filename))
-    close_figure()
+    save_figure(fig, filename, image_format)
+    close_figure(fig)
 
 
 # Task 2B
-def generate_3d_orbit(input_planets: list[str], filename: str):
+def generate_3d_orbit(input_planets: list[str], filename: str, resolution: int = None, tolerance: float = None, image_format: str = "png"):
     fig, ax = figure_setup(is_3D_orbit=True)
-    input_planets = [get_planet(_) for _ in input_planets]
-    plot_orbit(input_planets, True, True, ax)
-    finish_figure(ax, "3D Planet Orbits")
+    with stage("plot"):
+        input_planets = [get_planet(_) for _ in input_planets]
+        plot_orbit(input_planets, True, True, ax, OrbitSampling(resolution, tolerance))
+        finish_figure(ax, "3D Planet Orbits")
 
-    fig.savefig(os.path.join(dir_path, "cache", filename))
-    close_figure()
+    save_figure(fig, filename, image_format)
+    close_figure(fig)
 
 
 #Task 3
-def generate_2d_orbit_animation(input_planets: list[str], filename : str, colours: list[str] = get_colours()):
+def generate_2d_orbit_animation(input_planets: list[str], filename : str, colours: list[str] = get_colours(), progress=None, resolution: int = None, tolerance: float = None, animation_format: str = "gif", duration: float = None, fps: float = 15, max_frames: int = None, start: float = 0):
     fig, ax = figure_setup(is_3D_orbit=False)
-    input_planets = [get_planet(_) for _ in input_planets]
-    animation = animate_orbit(input_planets, False, ax, fig, colours)
-    finish_figure(ax, "2D Planet Orbits")
+    with stage("plot"):
+        input_planets = [get_planet(_) for _ in input_planets]
+        markers = plot_animation_markers(input_planets, False, ax, colours, OrbitSampling(resolution, tolerance))
+        finish_figure(ax, "2D Planet Orbits")
+    with stage("compute"):
+        num_frames, frame_step, start_frame, fps = get_animation_frames(input_planets, AnimationTiming(duration, fps, max_frames, start), animation_formats[animation_format].delay_step)
+        positions = calculate_animation_positions(input_planets, False, num_frames, frame_step, start_frame)
 
-    writer = PillowWriter(fps=15, bitrate=400)
-    animation.save(os.path.join(dir_path, "cache", filename), writer=writer)
-    close_figure()
+    save_animation(fig, ax, markers, positions, filename, fps=fps, progress=progress, animation_format=animation_format)
+    close_figure(fig)
 
 
 #Task 4
-def generate_3d_orbit_animation(input_planets: list[str], filename: str, colours: list[str] = get_colours()):
+def generate_3d_orbit_animation(input_planets: list[str], filename: str, colours: list[str] = get_colours(), progress=None, resolution: int = None, tolerance: float = None, animation_format: str = "gif", duration: float = None, fps: float = 15, max_frames: int = None, start: float = 0):
     fig, ax = figure_setup(is_3D_orbit=True)
-    input_planets = [get_planet(_) for _ in input_planets]
-    animation = animate_orbit(input_planets, True, ax, fig, colours)
-    finish_figure(ax, "3D Planet Orbits")
+    with stage("plot"):
+        input_planets = [get_planet(_) for _ in input_planets]
+        markers = plot_animation_markers(input_planets, True, ax, colours, OrbitSampling(resolution, tolerance))
+        finish_figure(ax, "3D Planet Orbits")
+    with stage("compute"):
+        num_frames, frame_step, start_frame, fps = get_animation_frames(input_planets, AnimationTiming(duration, fps, max_frames, start), animation_formats[animation_format].delay_step)
+        positions = calculate_animation_positions(input_planets, True, num_frames, frame_step, start_frame)
 
-    writer = PillowWriter(fps=15, bitrate=400)
-    animation.save(os.path.join(dir_path, "cache", filename), writer=writer)
-    close_figure()
+    save_animation(fig, ax, markers, positions, filename, fps=fps, progress=progress, animation_format=animation_format)
+    close_figure(fig)
 
 
 #Task 5
-def generate_angle_vs_time(input_planet: str, filename: str):
+def generate_angle_vs_time(input_planet: str, filename: str, image_format: str = "png"):
     fig, ax = figure_setup(is_3D_orbit=False)
-    input_planet = get_planet(input_planet)
-    angle_vs_time(ax, input_planet)
-    finish_figure(ax, "Angle vs Time")
+    with stage("plot"):
+        input_planet = get_planet(input_planet)
+        angle_vs_time(ax, input_planet)
+        finish_figure(ax, "Angle vs Time")
 
-    fig.savefig(os.path.join(dir_path, "cache", filename))
-    close_figure()
+    save_figure(fig, filename, image_format)
+    close_figure(fig)
 
 
 # Task 6
-def generate_spinograph(input_planets: list[str], filename: str):
+def generate_spinograph(input_planets: list[str], filename: str, num_segments: int = 1234, resolution: int = None, tolerance: float = None, image_format: str = "png"):
     fig, ax = figure_setup(is_3D_orbit=False)
-    input_planets = [get_planet(_) for _ in input_planets]
-    plot_spinograph(input_planets, False, ax)
-    finish_figure(ax, "Spinograph")
+    with stage("plot"):
+        input_planets = [get_planet(_) for _ in input_planets]
+        plot_spinograph(input_planets, False, ax, num_segments, OrbitSampling(resolution, tolerance))
+        finish_figure(ax, "Spinograph")
 
-    fig.savefig(os.path.join(dir_path, "cache", filename))
-    close_figure()
+    save_figure(fig, filename, image_format)
+    close_figure(fig)
 
 
 # Task 7A
-def generate_2d_imaginary_orbit(input_centre_planet: str, input_planets: list[str], filename: str):
+def generate_2d_imaginary_orbit(input_centre_planet: str, input_planets: list[str], filename: str, resolution: int = 1000, span: float = None, step: float = None, image_format: str = "png"):
     fig, ax = figure_setup(is_3D_orbit=False)
-    input_planets = [get_planet(_) for _ in input_planets]
-    input_centre_planet = get_planet(input_centre_planet)
-    plot_imaginary_orbit(input_centre_planet, input_planets, False, ax)
-    finish_figure(ax, "2D Imaginary Orbits")
+    with stage("plot"):
+        input_planets = [get_planet(_) for _ in input_planets]
+        input_centre_planet = get_planet(input_centre_planet)
+        plot_imaginary_orbit(input_centre_planet, input_planets, False, ax, resolution, span, step)
+        finish_figure(ax, "2D Imaginary Orbits")
 
-    fig.savefig(os.path.join(dir_path, "cache", filename))
-    close_figure()
+    save_figure(fig, filename, image_format)
+    close_figure(fig)
 
 
 # Task 7B
-def generate_3d_imaginary_orbit(input_centre_planet: str, input_planets: list[str], filename: str):
+def generate_3d_imaginary_orbit(input_centre_planet: str, input_planets: list[str], filename: str, resolution: int = 1000, span: float = None, step: float = None, image_format: str = "png"):
     fig, ax = figure_setup(is_3D_orbit=True)
-    input_planets = [get_planet(_) for _ in input_planets]
-    input_centre_planet = get_planet(input_centre_planet)
-    plot_imaginary_orbit(input_centre_planet, input_planets, True, ax)
-    finish_figure(ax, "3D Imaginary Orbits")
+    with stage("plot"):
+        input_planets = [get_planet(_) for _ in input_planets]
+        input_centre_planet = get_planet(input_centre_planet)
+        plot_imaginary_orbit(input_centre_planet, input_planets, True, ax, resolution, span, step)
+        finish_figure(ax, "3D Imaginary Orbits")
 
-    fig.savefig(os.path.join(dir_path, "cache", filename))
-    close_figure()
+    save_figure(fig, filename, image_format)
+    close_figure(fig)
 
 
 ## GRAPH FUNCTIONS
 
+class FigurePool:
+    """
+    Keeps built 2D and 3D figures between renders, so a render only clears the axes
+    instead of building a new figure (the 3D projection is the costly part). Figures
+    use the object-oriented Figure/FigureCanvasAgg API and never touch pyplot's global
+    state, and each figure is used by one render at a time
+    """
+
+    def __init__(self, max_idle: int = 4) -> None:
+        self.max_idle = max_idle
+        self.idle = {False: [], True: []}  # is_3D_orbit -> list of (fig, ax)
+        self.lock = Lock()
+
+    def acquire(self, is_3D_orbit: bool):
+        with self.lock:
+            if self.idle[is_3D_orbit]:
+                return self.idle[is_3D_orbit].pop()
+
+        fig = Figure(figsize=(8, 8))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(projection = "3d") if is_3D_orbit else fig.add_subplot()
+        return fig, ax
+
+    def release(self, fig) -> None:
+        ax = fig.axes[0]
+        ax.cla()
+        is_3D_orbit = ax.name == "3d"
+
+        with self.lock:
+            if len(self.idle[is_3D_orbit]) < self.max_idle:
+                self.idle[is_3D_orbit].append((fig, ax))
+
+
+figure_pool = FigurePool()
+
+
 def figure_setup(is_3D_orbit: bool):
-    fig = plt.figure()
-    fig.set_figwidth(8)
-    fig.set_figheight(8)
-    ax = fig.add_subplot(projection = "3d") if is_3D_orbit else fig.add_subplot()
-    return fig, ax
+    with stage("setup"):
+        return figure_pool.acquire(is_3D_orbit)
 
 
 def finish_figure(ax, title: str) -> None:
@@ -130,9 +188,209 @@ def finish_figure(ax, title: str) -> None:
     ax.grid()
 
 
-def show_figure():
-    plt.show()
-
-
-def close_figure():
-    plt.close()
\ No newline at end of file
+@contextmanager
+def atomic_cache_file(filename: str):
+    """
+    Yields a temporary path to write a cache file to, then renames it into place so
+    readers never see a half-written file
+    """
+    path = os.path.join(dir_path, "cache", filename)
+    temp_path = os.path.join(dir_path, "cache", "." + filename + "." + uuid.uuid4().hex + ".tmp")
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def write_cache_file(filename: str, data: bytes) -> None:
+    with stage("write"), atomic_cache_file(filename) as temp_path:
+        with open(temp_path, "wb") as file:
+            file.write(data)
+
+
+def save_figure(fig, filename: str, image_format: str = "png") -> None:
+    """
+    Writes the figure as a lossless PNG or WebP, or as a PNG or WebP whose colours are
+    reduced to a 256-colour palette (see formats.still_formats)
+    """
+    with stage("draw"):
+        fig.canvas.draw()
+
+    with stage("encode"):
+        output = io.BytesIO()
+        if image_format == "png":
+            # What fig.savefig writes, without drawing the figure again
+            imsave(output, fig.canvas.buffer_rgba(), format="png", origin="upper", dpi=fig.dpi)
+        else:
+            image = Image.frombuffer("RGBA", fig.canvas.get_width_height(), fig.canvas.buffer_rgba()).convert("RGB")
+            output_format = still_formats[image_format]
+            if output_format.quantised:
+                image = image.quantize(colors=256, dither=Image.Dither.NONE)
+
+            if output_format.extension == "webp":
+                image.save(output, format="WEBP", lossless=True, method=4)
+            else:
+                image.save(output, format="PNG", optimize=True)
+
+    write_cache_file(filename, output.getvalue())
+
+
+def save_animation(fig, ax, markers, positions, filename: str, fps: float, progress=None, animation_format: str = "gif") -> None:
+    """
+    Rasterises the static background (orbits, Sun, legend, axes) once, then composites
+    every frame from that background and one cached sprite per marker, placed at the
+    markers' pixel positions, without drawing with matplotlib again. The frames share one
+    palette and are written straight to the animation format.
+    progress(frames_done, frames_total) is called after every frame if given
+    """
+    canvas = fig.canvas
+
+    with stage("draw"):
+        # Markers are animated, so they are not part of this draw
+        canvas.draw()
+        background = np.asarray(canvas.buffer_rgba())[..., :3].copy()
+
+    with stage("composite"):
+        sprites = [get_marker_sprite(marker, fig.dpi) for marker in markers]
+        pixels = project_markers(ax, positions)
+
+        palette = None
+        frames = []
+        for i in range(pixels.shape[1]):
+            frame = background.copy()
+            for sprite, (column, row) in zip(sprites, pixels[:, i]):
+                paste_sprite(frame, sprite, column, row)
+
+            frame = Image.fromarray(frame)
+            if palette is None:
+                palette = build_palette(frame, [marker.get_color() for marker in markers])
+            frames.append(frame.quantize(palette=palette, dither=Image.Dither.NONE))
+            if progress is not None:
+                progress(i + 1, pixels.shape[1])
+
+    with stage("encode"):
+        output = io.BytesIO()
+        if animation_format == "mp4":
+            save_mp4(frames, output, fps)
+        elif animation_format == "webp":
+            frames[0].save(output, format="WEBP", save_all=True, append_images=frames[1:], duration=round(1000 / fps), loop=0, lossless=True, method=4)
+        elif animation_format == "apng":
+            frames[0].save(output, format="PNG", save_all=True, append_images=frames[1:], duration=round(1000 / fps), loop=0)
+        else:
+            frames[0].save(output, format="GIF", save_all=True, append_images=frames[1:], duration=round(1000 / fps), loop=0, optimize=False)
+
+    write_cache_file(filename, output.getvalue())
+
+
+def save_mp4(frames, output, fps: float) -> None:
+    """
+    Encodes the frames as H.264 (or MPEG-4 Part 2 if PyAV's FFmpeg has no H.264 encoder)
+    with PyAV, which bundles its own FFmpeg libraries
+    """
+    import av
+
+    with av.open(output, mode="w", format="mp4") as container:
+        stream = container.add_stream("libx264" if "libx264" in av.codecs_available else "mpeg4", rate=Fraction(fps).limit_denominator(1000))
+        stream.width, stream.height = frames[0].size
+        stream.pix_fmt = "yuv420p"
+        for frame in frames:
+            container.mux(stream.encode(av.VideoFrame.from_image(frame.convert("RGB"))))
+        container.mux(stream.encode())
+
+
+# Rendered marker sprites by marker style and dpi, shared by every animation
+marker_sprites = {}
+marker_sprites_lock = Lock()
+
+
+def get_marker_sprite(marker, dpi: float) -> (np.ndarray, np.ndarray):
+    """
+    Returns the (alpha, colour) arrays of a marker drawn at the centre of a small square,
+    found by drawing it once on black and once on white. Agg snaps markers to whole
+    pixels, so pasting the sprite at the rounded pixel position gives the same pixels as
+    drawing the marker there (up to rounding)
+    """
+    style = (marker.get_marker(), marker.get_markersize(), to_rgb(marker.get_markerfacecolor()),
+             to_rgb(marker.get_markeredgecolor()), marker.get_markeredgewidth(), dpi)
+    with marker_sprites_lock:
+        sprite = marker_sprites.get(style)
+    if sprite is not None:
+        return sprite
+
+    size = 2 * int(np.ceil((marker.get_markersize() + marker.get_markeredgewidth()) * dpi / 72)) + 4
+    renders = []
+    for facecolor in ("black", "white"):
+        fig = Figure(figsize=(size / dpi, size / dpi), dpi=dpi, facecolor=facecolor)
+        FigureCanvasAgg(fig)
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.set_axis_off()
+        ax.set_xlim(0, size)
+        ax.set_ylim(0, size)
+        ax.plot([size / 2], [size / 2], linestyle="none", marker=marker.get_marker(), markersize=marker.get_markersize(),
+                markerfacecolor=marker.get_markerfacecolor(), markeredgecolor=marker.get_markeredgecolor(),
+                markeredgewidth=marker.get_markeredgewidth())
+        fig.canvas.draw()
+        renders.append(np.asarray(fig.canvas.buffer_rgba())[..., :3].astype(float))
+
+    on_black, on_white = renders
+    alpha = 1 - (on_white - on_black).mean(axis=2, keepdims=True) / 255
+    colour = np.where(alpha > 0, on_black / np.maximum(alpha, 1e-9), 0)
+    sprite = (alpha, colour)
+
+    with marker_sprites_lock:
+        marker_sprites[style] = sprite
+    return sprite
+
+
+def project_markers(ax, positions) -> np.ndarray:
+    """
+    Converts the (planets, frames) marker positions to (planets, frames, 2) rounded pixel
+    positions (column, row from the top) in the figure's last draw
+    """
+    x, y, z = positions
+    if z is not None:
+        # The projection the 3D axes used in the last draw
+        x, y, _ = proj3d.proj_transform(x.ravel(), y.ravel(), z.ravel(), ax.M)
+    display = ax.transData.transform(np.column_stack((np.ravel(x), np.ravel(y))))
+
+    height = ax.figure.bbox.height
+    pixels = np.column_stack((np.round(display[:, 0]), height - np.round(display[:, 1]))).astype(int)
+    return pixels.reshape(positions[0].shape + (2,))
+
+
+def paste_sprite(frame: np.ndarray, sprite, column: int, row: int) -> None:
+    """
+    Blends a marker sprite into the frame (rows, columns, RGB) with its centre at
+    (column, row), clipped to the frame
+    """
+    alpha, colour = sprite
+    size = alpha.shape[0]
+    top, left = row - size // 2, column - size // 2
+
+    frame_top, frame_left = max(top, 0), max(left, 0)
+    frame_bottom, frame_right = min(top + size, frame.shape[0]), min(left + size, frame.shape[1])
+    if frame_top >= frame_bottom or frame_left >= frame_right:
+        return
+
+    sprite_rows = slice(frame_top - top, frame_bottom - top)
+    sprite_columns = slice(frame_left - left, frame_right - left)
+    region = frame[frame_top:frame_bottom, frame_left:frame_right]
+    blended = region * (1 - alpha[sprite_rows, sprite_columns]) + colour[sprite_rows, sprite_columns] * alpha[sprite_rows, sprite_columns]
+    frame[frame_top:frame_bottom, frame_left:frame_right] = np.round(blended).astype(np.uint8)
+
+
+def build_palette(frame, colours: list[str], num_colours: int = 64):
+    """
+    Builds the palette shared by every frame of an animation from the first frame
+    plus a strip of every marker colour, so the markers keep their exact colours
+    """
+    swatch = np.zeros((len(colours), frame.width, 3), dtype=np.uint8)
+    for index, colour in enumerate(colours):
+        swatch[index] = np.round(np.array(to_rgb(colour)) * 255)
+    return Image.fromarray(np.concatenate((np.asarray(frame), swatch))).quantize(colors=num_colours)
+
+
+def close_figure(fig):
+    figure_pool.release(fig)
\ No newline at end of file
@@ -1,28 +1,365 @@
+import json
+import mimetypes
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from errno import EEXIST
-from os import makedirs, path, listdir
+from os import getpid, makedirs, path, listdir, remove, replace
+from threading import Event, Lock
+
+from cache_keys import make_etag, render_version
+from metrics import metrics
+
+@dataclass
+class CachedFile:
+    data: bytes
+    etag: str
+    mimetype: str
+    content_length: int
+
+
+class HotCache:
+    """
+    Bounded in-memory LRU of encoded files, so popular files are served without disk I/O.
+    Files larger than max_file_bytes are never kept in memory
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 ** 2, max_file_bytes: int = 8 * 1024 ** 2) -> None:
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.files = OrderedDict()  # filename -> CachedFile, least recent first
+        self.total_bytes = 0
+        self.lock = Lock()
+
+    def get(self, key) -> CachedFile:
+        with self.lock:
+            cached_file = self.files.get(key)
+            if cached_file is not None:
+                self.files.move_to_end(key)
+            return cached_file
+
+    def set(self, key, cached_file: CachedFile):
+        if cached_file.content_length > self.max_file_bytes:
+            return
+
+        with self.lock:
+            self.discard_entry(key)
+            self.files[key] = cached_file
+            self.total_bytes += cached_file.content_length
+            while self.total_bytes > self.max_bytes:
+                self.discard_entry(next(iter(self.files)))
+
+    def discard(self, key):
+        with self.lock:
+            self.discard_entry(key)
+
+    def discard_entry(self, key):
+        cached_file = self.files.pop(key, None)
+        if cached_file is not None:
+            self.total_bytes -= cached_file.content_length
+
+
+# The cache folder next to this file, where bpho_service writes the rendered files
+cache_dir = path.join(path.dirname(path.abspath(__file__)), 'cache')
+
 
 class Cache:
-    def __init__(self) -> None:
-        self.cache = {}
+    """
+    Index of the rendered files in the cache folder. Every entry records the file's size
+    and last access time, and the least recently used files are deleted from disk once
+    max_bytes or max_entries is exceeded. The index is saved to the cache folder so
+    startup does not have to rescan it, and is loaded by register_cache or else on first
+    use. Several processes can share the folder: files they wrote are adopted when first
+    asked for, and saves merge with the index on disk. A HotCache of file contents sits
+    in front of the folder
+    """
+
+    index_filename = '.index.json'
+
+    # render_version of the files in the folder
+    version_filename = '.render_version'
+
+    # seconds between saves of the index caused only by reads
+    index_save_interval = 60
+
+    def __init__(self, directory: str = cache_dir, max_bytes: int = 2 * 1024 ** 3, max_entries: int = 10000) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.cache = OrderedDict()  # filename -> {"size": bytes, "last_access": unix time}, least recent first
+        self.total_bytes = 0
+        self.lock = Lock()
+        self.in_flight = {}
+        self.added = set()  # keys added since the last save, which the merge must keep
+        self.removed = set()  # keys removed since the last save, which the merge must not bring back
+        self.save_lock = Lock()
+        self.last_index_save = 0
+        self.registered = False
+        self.register_lock = Lock()
+        self.hot = HotCache()
         self.make_cache_dir()
 
     def make_cache_dir(self):
         try:
-            makedirs('cache')
+            makedirs(self.directory)
         except OSError as exc:
-            if exc.errno == EEXIST and path.isdir('cache'):
+            if exc.errno == EEXIST and path.isdir(self.directory):
                 pass
             else: raise
 
-    # register all filenames in the cache folder
+    # register all filenames in the cache folder, from the saved index if there is one
     def register_cache(self):
-        for filename in listdir('cache'):
-            self.cache[filename] = True
-        print("Cache registered...")
-        print(self.cache)
-    
+        with self.register_lock:
+            if self.registered:
+                return
+            with self.lock:
+                self.clear_stale_files()
+                if not self.load_index():
+                    self.scan_cache_dir()
+                self.evict()
+                self.registered = True
+            self.save_index()
+        print(f"Cache registered: {len(self.cache)} files, {self.total_bytes / 1024 ** 2:.1f} MB")
+
+    def ensure_registered(self):
+        if not self.registered:
+            self.register_cache()
+
+    def clear_stale_files(self):
+        """
+        Deletes every file and the index if the folder was rendered by another
+        render_version, since their ETags would claim they are the current output
+        """
+        version_path = path.join(self.directory, self.version_filename)
+        try:
+            with open(version_path) as version_file:
+                if version_file.read().strip() == str(render_version):
+                    return
+        except OSError:
+            pass
+
+        for filename in listdir(self.directory):
+            if not filename.startswith('.') or filename == self.index_filename:
+                remove(path.join(self.directory, filename))
+        with open(version_path, 'w') as version_file:
+            version_file.write(str(render_version))
+        print(f"Cache cleared: the files were not rendered by render version {render_version}")
+
+    def read_index(self) -> dict:
+        """
+        Returns the index saved in the cache folder, or None if there is none
+        """
+        try:
+            with open(path.join(self.directory, self.index_filename)) as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return None
+
+    def load_index(self) -> bool:
+        entries = self.read_index()
+        if entries is None:
+            return False
+
+        entries = sorted(entries.items(), key=lambda item: item[1]["last_access"])
+        self.cache = OrderedDict(entries)
+        self.total_bytes = sum(entry["size"] for entry in self.cache.values())
+        return True
+
+    def scan_cache_dir(self):
+        files = []
+        for filename in listdir(self.directory):
+            # skip the index and temporary files of renders that are still being written
+            if filename.startswith('.'):
+                continue
+            file_path = path.join(self.directory, filename)
+            files.append((filename, {"size": path.getsize(file_path), "last_access": path.getmtime(file_path)}))
+
+        self.cache = OrderedDict(sorted(files, key=lambda item: item[1]["last_access"]))
+        self.total_bytes = sum(entry["size"] for entry in self.cache.values())
+
+    def save_index(self):
+        """
+        Saves the index merged with the one on disk, which other processes sharing the
+        folder may have saved since. The disk I/O is done without holding the lock
+        """
+        with self.save_lock:
+            saved = self.read_index()
+            with self.lock:
+                if saved is not None:
+                    self.merge_index(saved)
+                self.added.clear()
+                self.removed.clear()
+                entries = json.dumps(self.cache)
+
+            index_path = path.join(self.directory, self.index_filename)
+            temp_path = index_path + '.' + str(getpid()) + '.tmp'
+            with open(temp_path, 'w') as index_file:
+                index_file.write(entries)
+            replace(temp_path, index_path)
+            self.last_index_save = time.time()
+
+    def merge_index(self, saved: dict):
+        """
+        Adds the entries of a saved index that this process does not know about and has not
+        removed itself, drops the ones another process removed and keeps the latest access
+        time of the others
+        """
+        for key in [key for key in self.cache if key not in saved and key not in self.added]:
+            self.hot.discard(key)
+            self.total_bytes -= self.cache.pop(key)["size"]
+
+        is_added = False
+        for key, saved_entry in saved.items():
+            entry = self.cache.get(key)
+            if entry is not None:
+                entry["last_access"] = max(entry["last_access"], saved_entry["last_access"])
+            elif key not in self.removed:
+                self.cache[key] = dict(saved_entry)
+                self.total_bytes += saved_entry["size"]
+                is_added = True
+
+        if is_added:
+            self.cache = OrderedDict(sorted(self.cache.items(), key=lambda item: item[1]["last_access"]))
+            self.evict()
+
     def get(self, key):
-        return self.cache.get(key)
-    
-    def set(self, key, value):
-        self.cache[key] = value
\ No newline at end of file
+        self.ensure_registered()
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                entry["last_access"] = time.time()
+                self.cache.move_to_end(key)
+                is_save_due = entry["last_access"] - self.last_index_save > self.index_save_interval
+
+        if entry is None:
+            return self.adopt(key)
+        if is_save_due:
+            self.save_index()
+        return entry
+
+    def adopt(self, key):
+        """
+        Registers a file that is in the cache folder but not in the index, e.g. written by
+        warmup.py or another process. Returns its entry, or None if there is no such file
+        """
+        # dotfiles are the index and temporary files of renders still being written
+        if key.startswith('.'):
+            return None
+        try:
+            self.set(key)
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            return self.cache.get(key)
+
+    def set(self, key, value=True):
+        """
+        Registers a file that has just been written to the cache folder
+        """
+        self.ensure_registered()
+        size = path.getsize(path.join(self.directory, key))
+        with self.lock:
+            self.remove_entry(key)
+            self.removed.discard(key)
+            self.added.add(key)
+            self.cache[key] = {"size": size, "last_access": time.time()}
+            self.total_bytes += size
+            self.evict(keep=key)
+        self.save_index()
+
+    def delete(self, key):
+        """
+        Forgets a file, e.g. because it was removed from the cache folder by hand
+        """
+        self.ensure_registered()
+        with self.lock:
+            self.remove_entry(key)
+        self.save_index()
+
+    def read(self, key) -> CachedFile:
+        """
+        Returns the contents of a cached file, from memory if possible. Files read from
+        disk are kept in memory for the next request
+        """
+        cached_file = self.hot.get(key)
+        if cached_file is not None:
+            metrics.inc("hot_cache_requests_total", result="hit")
+            return cached_file
+        metrics.inc("hot_cache_requests_total", result="miss")
+
+        with open(path.join(self.directory, key), 'rb') as file:
+            data = file.read()
+        cached_file = CachedFile(data=data,
+                                 etag=make_etag(key),
+                                 mimetype=mimetypes.guess_type(key)[0] or 'application/octet-stream',
+                                 content_length=len(data))
+        self.hot.set(key, cached_file)
+        return cached_file
+
+    def remove_entry(self, key):
+        self.hot.discard(key)
+        entry = self.cache.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry["size"]
+            self.removed.add(key)
+
+    def evict(self, keep=None):
+        """
+        Deletes the least recently used files until the cache is within its limits
+        """
+        while self.cache and (self.total_bytes > self.max_bytes or len(self.cache) > self.max_entries):
+            key = next(iter(self.cache))
+            # keep is the most recent entry, so only it is left
+            if key == keep:
+                break
+
+            self.remove_entry(key)
+            metrics.inc("cache_evictions_total")
+            try:
+                remove(path.join(self.directory, key))
+            except FileNotFoundError:
+                pass
+
+    def get_or_render(self, key, render, timeout=None) -> bool:
+        """
+        Makes sure key is cached, calling render() only if no other request is already
+        rendering the same key. Other requests wait for that render instead. Returns False
+        if timeout (seconds) passed while waiting
+        """
+        if self.get(key) is not None:
+            metrics.inc("cache_requests_total", result="hit")
+            return True
+
+        with self.lock:
+            event = self.in_flight.get(key)
+            is_owner = event is None
+            if is_owner:
+                event = self.in_flight[key] = Event()
+
+        if is_owner:
+            metrics.inc("cache_requests_total", result="miss")
+            try:
+                # another request may have finished rendering it since the check above
+                if key not in self.cache:
+                    start = time.perf_counter()
+                    try:
+                        render()
+                    except Exception:
+                        metrics.inc("cache_render_failures_total")
+                        raise
+                    metrics.observe("render_seconds", time.perf_counter() - start)
+                    self.set(key)
+            finally:
+                with self.lock:
+                    del self.in_flight[key]
+                event.set()
+            return True
+
+        metrics.inc("cache_requests_total", result="shared")
+        if not event.wait(timeout):
+            return False
+
+        # the render failed, so try it again from this request
+        if self.get(key) is None:
+            return self.get_or_render(key, render, timeout)
+        return True
@@ -0,0 +1,178 @@
+"""
+Canonical cache keys, so that equivalent requests share one cached file
+"""
+import hashlib
+from urllib.parse import quote
+
+from constants.data import catalogue
+from formats import still_formats, animation_formats, default_still_format, default_animation_format
+
+# Keys whose name is longer than this are shortened with a hash
+max_key_length = 120
+
+# Most planets in one chart
+max_planets = 16
+
+# Bump whenever a change to the rendering code changes the output, so clients and CDNs
+# stop using files rendered by the old code. The cache folder is cleared on the first
+# use of a new version (see Cache.clear_stale_files)
+render_version = 3
+
+
+class InvalidParameters(ValueError):
+    """
+    Raised when a request's parameters cannot be rendered
+    """
+    pass
+
+
+def planet_order() -> dict[str, int]:
+    return catalogue.index
+
+
+def normalise_planet(name: str) -> str:
+    if name is None:
+        raise InvalidParameters("A planet is required")
+    if name not in catalogue:
+        raise InvalidParameters(f"Unknown planet {name}")
+    return name
+
+
+def normalise_planets(names: list[str]) -> list[str]:
+    """
+    Validates the planet names, removes duplicates and sorts them in catalogue order
+    (the planets by distance from the Sun first), so every ordering of the same planets is
+    rendered and cached once
+    """
+    if not names:
+        raise InvalidParameters("At least one planet is required")
+
+    names = set(normalise_planet(name) for name in names)
+    if len(names) > max_planets:
+        raise InvalidParameters(f"At most {max_planets} planets can be shown at once")
+
+    order = planet_order()
+    return sorted(names, key=lambda name: order[name])
+
+
+def escape_name(name: str) -> str:
+    """
+    Escapes a planet name for a key part. Everything but letters, digits and .~ is
+    %-encoded, including / and the _ and - separators, so every name is a valid filename
+    and different sets of names never share a key. The solar system's names are unchanged
+    """
+    return quote(name, safe="").replace("_", "%5F").replace("-", "%2D")
+
+
+def planets_part(names: list[str]) -> str:
+    return "_".join(escape_name(name) for name in names)
+
+
+def make_key(prefix: str, parts: list[str], extension: str) -> str:
+    """
+    Builds a cache filename from every part that affects the render, e.g.
+    make_key("2d_img", ["Earth_Mars"], "png") == "2d_img-Earth_Mars.png"
+    """
+    name = prefix + "-" + "-".join(parts)
+    if len(name) > max_key_length:
+        name = prefix + "-" + hashlib.sha256(name.encode()).hexdigest()[:32]
+
+    return name + "." + extension
+
+
+def make_image_key(prefix: str, parts: list[str], image_format: str) -> str:
+    # The default format is left out so older cache files keep their names
+    parts = parts if image_format == default_still_format else parts + [image_format]
+    return make_key(prefix, parts, still_formats[image_format].extension)
+
+
+def make_animation_key(prefix: str, parts: list[str], animation_format: str) -> str:
+    parts = parts if animation_format == default_animation_format else parts + [animation_format]
+    return make_key(prefix, parts, animation_formats[animation_format].extension)
+
+
+def sampling_parts(resolution: int, tolerance: float) -> list[str]:
+    """
+    Key parts of a non-default orbit sampling, which are left out for the default so
+    older cache files keep their names
+    """
+    parts = []
+    if resolution is not None:
+        parts.append("n" + str(resolution))
+    if tolerance is not None:
+        parts.append("tol" + repr(tolerance))
+    return parts
+
+
+def time_span_parts(span: float, step: float) -> list[str]:
+    """
+    Key parts of a non-default time span of the imaginary orbits
+    """
+    parts = []
+    if span is not None:
+        parts.append("span" + repr(span))
+    if step is not None:
+        parts.append("step" + repr(step))
+    return parts
+
+
+def timing_parts(duration: float, fps: float, max_frames: int, start: float) -> list[str]:
+    """
+    Key parts of non-default animation timing
+    """
+    parts = []
+    if duration is not None:
+        parts.append("dur" + repr(duration))
+    if fps != 15:
+        parts.append("fps" + repr(fps))
+    if max_frames is not None:
+        parts.append("max" + str(max_frames))
+    if start != 0:
+        parts.append("start" + repr(start))
+    return parts
+
+
+def make_etag(key: str) -> str:
+    """
+    Strong ETag of the file cached under key, which only depends on the key and the
+    render version, so it is known without reading the file
+    """
+    return hashlib.sha256((str(render_version) + ":" + key).encode()).hexdigest()[:32]
+
+
+## ENDPOINT KEYS
+
+def kepler_correlation_key(image_format: str = "png") -> str:
+    if image_format == default_still_format:
+        return "kepler_correlation.png"
+    return make_key("kepler_correlation", [image_format], still_formats[image_format].extension)
+
+
+def orbit_image_key(input_planets: list[str], is_3d: bool, resolution: int = None, tolerance: float = None, image_format: str = "png") -> str:
+    return make_image_key("3d_img" if is_3d else "2d_img", [planets_part(input_planets)] + sampling_parts(resolution, tolerance), image_format)
+
+
+def orbit_animation_key(input_planets: list[str], is_3d: bool, resolution: int = None, tolerance: float = None, animation_format: str = "gif",
+                        duration: float = None, fps: float = 15, max_frames: int = None, start: float = 0) -> str:
+    parts = [planets_part(input_planets)] + sampling_parts(resolution, tolerance) + timing_parts(duration, fps, max_frames, start)
+    return make_animation_key("3d_anim" if is_3d else "2d_anim", parts, animation_format)
+
+
+def angle_vs_time_key(input_planet: str, image_format: str = "png") -> str:
+    return make_image_key("angle_vs_time", [escape_name(input_planet)], image_format)
+
+
+def spinograph_key(input_planets: list[str], num_segments: int, resolution: int = None, tolerance: float = None, image_format: str = "png") -> str:
+    # The default number of segments is left out so older cache files keep their names
+    parts = [planets_part(input_planets)] if num_segments == 1234 else [planets_part(input_planets), str(num_segments)]
+    return make_image_key("spinograph", parts + sampling_parts(resolution, tolerance), image_format)
+
+
+def imaginary_orbit_key(centre_planet: str, input_planets: list[str], is_3d: bool, resolution: int = 1000, span: float = None, step: float = None, image_format: str = "png") -> str:
+    parts = [escape_name(centre_planet), planets_part(input_planets)] + ([] if resolution == 1000 else ["n" + str(resolution)]) + time_span_parts(span, step)
+    return make_image_key("imaginary_3d_anim" if is_3d else "imaginary_2d_anim", parts, image_format)
+
+
+def data_key(endpoint: str, parts: list[str], data_format: str, max_points: int) -> str:
+    parts = parts + ["all" if max_points is None else str(max_points)]
+    return make_key("data_" + endpoint, parts, "json" if data_format == "json" else "bin")
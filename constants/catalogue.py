@@ -0,0 +1,97 @@
+"""
+Catalogue of orbiting bodies, stored as one array per orbital element
+"""
+import csv
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class Planet:
+    name: str  # name of planet
+    a: float  # semi-major axis
+    ecc: float  # eccentricity
+    p: float  # period of orbit
+    modified_p: float  # p relative to either Earth or Jupiter
+    beta: float # angle of inclination of orbit
+
+
+# Orbital elements stored for every body, in the order of Planet's fields
+element_columns = ["a", "ecc", "p", "modified_p", "beta"]
+
+
+class Catalogue:
+    """
+    Bodies stored column by column (numpy arrays in catalogue order) with a name -> index
+    dict, so a lookup costs the same however many bodies there are and the columns can be
+    handed to the vectorized orbit maths as they are
+    """
+
+    def __init__(self, names: list[str], columns: dict[str, np.ndarray]) -> None:
+        self.names = list(names)
+        self.columns = {column: np.asarray(columns[column], dtype=float) for column in element_columns}
+        self.index = {}  # name -> row
+        for row, name in enumerate(self.names):
+            if not name or name != name.strip() or not name.isprintable():
+                raise ValueError(f"Body {name!r} needs a name without leading or trailing spaces or control characters")
+            if name in self.index:
+                raise ValueError(f"Body {name} is in the catalogue twice")
+            self.index[name] = row
+
+        # Orbits the maths can draw: anything else gives NaN paths and positions
+        a, ecc, p, modified_p, beta = (self.columns[column] for column in element_columns)
+        is_valid = (a > 0) & (p > 0) & (modified_p > 0) & (ecc >= 0) & (ecc < 1) & np.isfinite(a) & np.isfinite(p) & np.isfinite(modified_p) & np.isfinite(beta)
+        for row in np.flatnonzero(~is_valid):
+            raise ValueError(f"Body {self.names[row]} has invalid orbital elements: a, p and modified_p must be positive and 0 <= ecc < 1")
+
+    @classmethod
+    def from_csv(cls, file_path: str) -> "Catalogue":
+        """
+        Reads a CSV file with a header row of name, a, ecc, p, beta and optionally
+        modified_p, which defaults to p
+        """
+        with open(file_path, newline="") as csv_file:
+            rows = list(csv.DictReader(csv_file))
+
+        columns = {column: [float(row[column]) for row in rows] for column in element_columns if column != "modified_p"}
+        columns["modified_p"] = [float(row.get("modified_p") or row["p"]) for row in rows]
+        return cls([row["name"] for row in rows], columns)
+
+    @classmethod
+    def from_binary(cls, file_path: str) -> "Catalogue":
+        """
+        Reads a catalogue written by to_binary
+        """
+        with np.load(file_path) as arrays:
+            return cls(arrays["name"].tolist(), {column: arrays[column] for column in element_columns})
+
+    def to_binary(self, file_path: str) -> None:
+        """
+        Writes the catalogue as a .npz file, which loads much faster than the CSV for large
+        catalogues
+        """
+        np.savez(file_path, name=np.array(self.names), **self.columns)
+
+    def __add__(self, other: "Catalogue") -> "Catalogue":
+        return Catalogue(self.names + other.names,
+                         {column: np.concatenate((self.columns[column], other.columns[column])) for column in element_columns})
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def get(self, name: str) -> Planet:
+        row = self.index.get(name)
+        if row is None:
+            raise ValueError(f"Planet {name} not found")
+        return Planet(name, *(float(self.columns[column][row]) for column in element_columns))
+
+    def planets(self) -> list[Planet]:
+        return [self.get(name) for name in self.names]
+
+
+def load_catalogue(file_path: str) -> Catalogue:
+    return Catalogue.from_binary(file_path) if file_path.endswith(".npz") else Catalogue.from_csv(file_path)
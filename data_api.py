@@ -0,0 +1,114 @@
+"""
+The arrays behind the rendered images, for clients that draw the charts themselves.
+Every response is a list of named series, each with a few equally long columns
+"""
+import json
+
+import numpy as np
+
+from bpho_computation import OrbitSampling, AnimationTiming, get_orbit_paths, get_animation_frames, calculate_animation_positions, calculate_spinograph_segments, calculate_imaginary_times, calculate_relative_orbits, calculate_angle_vs_time
+from constants.data import get_planet
+
+# Number of values in each chunk of a streamed response
+chunk_size = 65536
+
+# Decimal places kept in JSON responses
+json_decimals = 6
+
+
+## SERIES
+
+def make_series(name: str, **columns) -> dict:
+    return {"name": name, "columns": {column: values for column, values in columns.items() if values is not None}}
+
+
+def orbit_series(input_planets: list[str], is_3d: bool, resolution: int = None, tolerance: float = None) -> list[dict]:
+    input_planets = [get_planet(_) for _ in input_planets]
+    paths = get_orbit_paths(input_planets, is_3d, OrbitSampling(resolution, tolerance))
+    return [make_series(planet.name, x=x, y=y, z=z) for planet, (x, y, z) in zip(input_planets, paths)]
+
+
+def orbit_animation_series(input_planets: list[str], is_3d: bool, duration: float = None, fps: float = 15, max_frames: int = None, start: float = 0) -> list[dict]:
+    input_planets = [get_planet(_) for _ in input_planets]
+    num_frames, frame_step, start_frame, _ = get_animation_frames(input_planets, AnimationTiming(duration, fps, max_frames, start))
+    x, y, z = calculate_animation_positions(input_planets, is_3d, num_frames, frame_step, start_frame)
+    return [make_series(planet.name, x=x[index], y=y[index], z=z[index] if is_3d else None)
+            for index, planet in enumerate(input_planets)]
+
+
+def spinograph_series(input_planets: list[str], num_segments: int) -> list[dict]:
+    input_planets = [get_planet(_) for _ in input_planets]
+    x, y = calculate_spinograph_segments(input_planets, False, num_segments)
+    # Segment i joins (x1[i], y1[i]) to (x2[i], y2[i])
+    return [make_series("segments", x1=x[0], y1=y[0], x2=x[1], y2=y[1])]
+
+
+def imaginary_orbit_series(centre_planet: str, input_planets: list[str], is_3d: bool, num_steps: int = 1000, span: float = None, step: float = None) -> list[dict]:
+    centre_planet = get_planet(centre_planet)
+    input_planets = [get_planet(_) for _ in input_planets]
+    t = calculate_imaginary_times(centre_planet, input_planets, num_steps, span, step)
+    x, y, z = calculate_relative_orbits(centre_planet, input_planets, is_3d, t)
+    return [make_series(planet.name, x=x[index], y=y[index], z=z[index] if is_3d else None)
+            for index, planet in enumerate(input_planets)]
+
+
+def angle_vs_time_series(input_planet: str) -> list[dict]:
+    t, theta_circ, theta_ecc = calculate_angle_vs_time(get_planet(input_planet))
+    return [make_series("Circular", t=t, theta=theta_circ), make_series("Eccentric", t=t, theta=theta_ecc)]
+
+
+def downsample(series: list[dict], max_points: int) -> list[dict]:
+    """
+    Keeps every n-th value of every column so no series is longer than max_points
+    """
+    if max_points is None:
+        return series
+
+    downsampled = []
+    for single_series in series:
+        length = len(next(iter(single_series["columns"].values())))
+        step = max(1, int(np.ceil(length / max_points)))
+        downsampled.append(make_series(single_series["name"], **{column: values[::step] for column, values in single_series["columns"].items()}))
+    return downsampled
+
+
+## ENCODINGS
+
+def encode_json(series: list[dict]):
+    """
+    Yields the series as JSON in chunks:
+    {"series": [{"name": "Earth", "length": 1000, "columns": {"x": [...], "y": [...]}}, ...]}
+    """
+    yield '{"series": ['
+    for index, single_series in enumerate(series):
+        columns = single_series["columns"]
+        length = len(next(iter(columns.values())))
+        yield ("," if index else "") + '{"name": ' + json.dumps(single_series["name"]) + ', "length": ' + str(length) + ', "columns": {'
+
+        for column_index, (column, values) in enumerate(columns.items()):
+            yield ("," if column_index else "") + json.dumps(column) + ": ["
+            for start in range(0, len(values), chunk_size):
+                yield ("," if start else "") + json.dumps(np.round(values[start:start + chunk_size], json_decimals).tolist())[1:-1]
+            yield "]"
+        yield "}}"
+    yield "]}"
+
+
+def binary_layout(series: list[dict]) -> list[dict]:
+    """
+    Describes the binary encoding: the columns of every series, in order, each a run of
+    length little-endian float32 values
+    """
+    return [{"name": single_series["name"], "columns": list(single_series["columns"]),
+             "length": len(next(iter(single_series["columns"].values())))} for single_series in series]
+
+
+def encode_binary(series: list[dict]):
+    """
+    Yields the columns of every series as little-endian float32 in chunks
+    """
+    for single_series in series:
+        for values in single_series["columns"].values():
+            values = np.asarray(values, dtype="<f4")
+            for start in range(0, len(values), chunk_size):
+                yield values[start:start + chunk_size].tobytes()
@@ -0,0 +1,41 @@
+"""
+Output formats of the rendered files, chosen with ?format= or else from the Accept header
+"""
+from dataclasses import dataclass
+from importlib.util import find_spec
+
+# PyAV is optional, MP4 animations are only offered when it is installed. It is only
+# imported when an MP4 is encoded
+has_av = find_spec("av") is not None
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    name: str  # value of ?format=
+    extension: str  # extension of the cache file
+    mimetype: str  # media type a client lists in its Accept header to get this format
+    quantised: bool = False  # colours reduced to a 256-colour palette
+    delay_step: float = None  # unit (seconds) of the frame delays an animation format stores
+
+
+still_formats = {output_format.name: output_format for output_format in [
+    OutputFormat("png", "png", "image/png"),
+    OutputFormat("png8", "png", "image/png", quantised=True),
+    OutputFormat("webp", "webp", "image/webp"),
+    OutputFormat("webp8", "webp", "image/webp", quantised=True),
+]}
+
+animation_formats = {output_format.name: output_format for output_format in [
+    OutputFormat("gif", "gif", "image/gif", delay_step=0.01),
+    OutputFormat("webp", "webp", "image/webp", delay_step=0.001),
+    OutputFormat("apng", "png", "image/apng", delay_step=0.001),
+] + ([OutputFormat("mp4", "mp4", "video/mp4")] if has_av else [])}
+
+default_still_format = "png"
+default_animation_format = "gif"
+
+# Formats picked from the Accept header, smallest first. Only lossless formats are picked
+# without being asked for, and MP4 never is since it cannot be shown in an <img>
+still_preference = ["webp"]
+animation_preference = ["webp", "apng"]
+
@@ -0,0 +1,137 @@
+"""
+Counters, gauges and timing histograms of the render pipeline, exported in the Prometheus
+text format, plus the per-request stage timings sent in the Server-Timing header
+"""
+import time
+from contextlib import contextmanager
+from threading import Lock, local
+
+# Upper bounds (seconds) of the timing histogram buckets
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Metrics:
+    """
+    A registry of metrics. Counters and histograms are keyed by name and label values;
+    gauges are functions called on every scrape
+    """
+
+    prefix = "bpho_"
+
+    def __init__(self) -> None:
+        self.descriptions = {}  # name -> (type, help)
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+        self.gauges = {}  # name -> function returning the value
+        self.lock = Lock()
+
+    def describe(self, name: str, metric_type: str, description: str) -> None:
+        self.descriptions[name] = (metric_type, description)
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(key, [[0] * len(default_buckets), 0.0, 0])
+            for index, bound in enumerate(default_buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def gauge(self, name: str, function, description: str) -> None:
+        self.describe(name, "gauge", description)
+        self.gauges[name] = function
+
+    def render(self) -> str:
+        """
+        Returns every metric in the Prometheus text exposition format
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: [list(buckets), total, count] for key, (buckets, total, count) in self.histograms.items()}
+
+        lines = []
+
+        def header(name: str):
+            metric_type, description = self.descriptions.get(name, ("untyped", ""))
+            lines.append(f"# HELP {self.prefix}{name} {description}")
+            lines.append(f"# TYPE {self.prefix}{name} {metric_type}")
+
+        for name in sorted({name for name, _ in counters}):
+            header(name)
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f"{self.prefix}{name}{format_labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in histograms}):
+            header(name)
+            for (histogram_name, labels), (buckets, total, count) in sorted(histograms.items()):
+                if histogram_name != name:
+                    continue
+                for bound, bucket_count in zip(default_buckets, buckets):
+                    lines.append(f"{self.prefix}{name}_bucket{format_labels(labels + (('le', str(bound)),))} {bucket_count}")
+                lines.append(f"{self.prefix}{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.prefix}{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{self.prefix}{name}_count{format_labels(labels)} {count}")
+
+        for name, function in sorted(self.gauges.items()):
+            header(name)
+            lines.append(f"{self.prefix}{name} {function()}")
+
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+metrics = Metrics()
+metrics.describe("render_stage_seconds", "histogram", "Time spent in each stage of a render: plot (orbit maths and artists), compute, draw (rasterising), encode and write (disk I/O)")
+metrics.describe("render_seconds", "histogram", "Time of whole renders started by a cache miss")
+metrics.describe("cache_requests_total", "counter", "Cache lookups by result: hit, miss (rendered by this request) or shared (waited for another request's render)")
+metrics.describe("cache_evictions_total", "counter", "Files deleted from the cache folder to keep it within its limits")
+metrics.describe("cache_render_failures_total", "counter", "Renders that raised an exception")
+metrics.describe("hot_cache_requests_total", "counter", "Reads of cached files by result: hit (served from memory) or miss (read from disk)")
+
+
+## STAGE TIMINGS
+
+# Stage timings of the request being handled by the current thread, for Server-Timing
+request_timings = local()
+
+
+def start_request_timing() -> None:
+    request_timings.stages = {}
+
+
+def finish_request_timing() -> dict:
+    """
+    Returns the seconds spent in every stage since start_request_timing
+    """
+    stages = getattr(request_timings, "stages", None)
+    request_timings.stages = None
+    return stages or {}
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Times a stage of a render, both in the render_stage_seconds histogram and in the
+    current request's timings
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe("render_stage_seconds", seconds, stage=name)
+        stages = getattr(request_timings, "stages", None)
+        if stages is not None:
+            stages[name] = stages.get(name, 0) + seconds
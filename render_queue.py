@@ -0,0 +1,166 @@
+"""
+Background render queue for renders that are too slow to run inside a request
+"""
+import itertools
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from queue import PriorityQueue
+from threading import Condition, Thread
+
+
+@dataclass
+class RenderJob:
+    id: str
+    key: str  # cache key of the file being rendered
+    url: str  # where the file can be fetched once the job is done
+    priority: int  # lower runs first
+    status: str = "queued"  # queued, running, done or failed
+    frames_done: int = 0
+    frames_total: int = None
+    error: str = None
+    created: float = field(default_factory=time.time)
+    finished: float = None
+
+    def is_finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "status": self.status, "url": self.url, "priority": self.priority,
+                "frames_done": self.frames_done, "frames_total": self.frames_total, "error": self.error}
+
+
+@dataclass
+class RenderTask:
+    """
+    A call of one of bpho_service's generators. Unlike a closure it can be pickled, so it
+    can also be run in a process pool
+    """
+    generator: str  # name of the generator in bpho_service
+    args: tuple
+    kwargs: dict = field(default_factory=dict)
+
+    def __call__(self, progress=None):
+        # progress is only passed to the animation generators, which report their frames
+        kwargs = self.kwargs if progress is None else dict(self.kwargs, progress=progress)
+        return getattr(load_service(), self.generator)(*self.args, **kwargs)
+
+
+def load_service():
+    # Imported on first use, it pulls in matplotlib which takes most of the startup time
+    import bpho_service
+    return bpho_service
+
+
+class QueueFull(Exception):
+    """
+    Raised when a job is submitted while max_queued jobs are already waiting
+    """
+    pass
+
+
+class RenderQueue:
+    """
+    A job table plus a priority queue served by a fixed number of worker threads, so
+    slow renders never hold on to the request threads. Jobs render through the cache, so
+    a key is rendered once however many jobs or requests ask for it
+    """
+
+    # seconds a finished job stays in the job table, and the most finished jobs kept
+    finished_job_ttl = 600
+    max_finished_jobs = 1000
+
+    def __init__(self, cache, workers: int = 2, max_queued: int = 64) -> None:
+        self.cache = cache
+        self.max_queued = max_queued
+        self.jobs = {}  # job id -> RenderJob
+        self.jobs_by_key = {}  # cache key -> latest RenderJob
+        self.queue = PriorityQueue()
+        self.counter = itertools.count()
+        self.condition = Condition()
+        self.worker_count = workers
+        self.workers = []
+        self.workers_pid = None  # process the worker threads were started in
+
+    def start_workers(self):
+        # Started on the first submit rather than at import, so a process forked after
+        # importing (e.g. a gunicorn worker started with --preload) starts its own threads
+        if self.workers_pid != os.getpid():
+            self.workers_pid = os.getpid()
+            self.workers = [Thread(target=self.work, daemon=True) for _ in range(self.worker_count)]
+            for worker in self.workers:
+                worker.start()
+
+    def submit(self, key: str, url: str, render, priority: int = 0) -> RenderJob:
+        """
+        Queues render(progress) unless a job for the same key is already queued or running,
+        in which case that job is returned. progress(frames_done, frames_total) may be
+        called by the render to report how far it is. Raises QueueFull if max_queued jobs
+        are already waiting
+        """
+        with self.condition:
+            self.start_workers()
+            self.prune()
+
+            job = self.jobs_by_key.get(key)
+            if job is not None and not job.is_finished():
+                return job
+            if self.queue.qsize() >= self.max_queued:
+                raise QueueFull()
+
+            job = RenderJob(id=uuid.uuid4().hex, key=key, url=url, priority=priority)
+            self.jobs[job.id] = job
+            self.jobs_by_key[key] = job
+            self.queue.put((priority, next(self.counter), job.id, render))
+        return job
+
+    def get(self, job_id: str) -> RenderJob:
+        with self.condition:
+            return self.jobs.get(job_id)
+
+    def wait(self, job: RenderJob, timeout: float) -> RenderJob:
+        """
+        Blocks until the job is finished or timeout (seconds) has passed
+        """
+        with self.condition:
+            self.condition.wait_for(job.is_finished, timeout)
+        return job
+
+    def depth(self) -> int:
+        """
+        Number of jobs waiting for a worker
+        """
+        return self.queue.qsize()
+
+    def prune(self):
+        now = time.time()
+        finished = sorted((job for job in self.jobs.values() if job.is_finished()), key=lambda job: job.finished)
+        for index, job in enumerate(finished):
+            if now - job.finished > self.finished_job_ttl or len(finished) - index > self.max_finished_jobs:
+                del self.jobs[job.id]
+                if self.jobs_by_key.get(job.key) is job:
+                    del self.jobs_by_key[job.key]
+
+    def work(self):
+        while True:
+            _, _, job_id, render = self.queue.get()
+            with self.condition:
+                job = self.jobs[job_id]
+                job.status = "running"
+
+            def progress(frames_done: int, frames_total: int):
+                job.frames_done = frames_done
+                job.frames_total = frames_total
+
+            try:
+                self.cache.get_or_render(job.key, lambda: render(progress))
+                status, error = "done", None
+            except Exception as exc:
+                status, error = "failed", repr(exc)
+
+            with self.condition:
+                job.status = status
+                job.error = error
+                job.finished = time.time()
+                self.condition.notify_all()
@@ -0,0 +1,113 @@
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import app as app_module
+from cache import Cache
+from cache_keys import make_etag, orbit_animation_key, orbit_image_key, render_version
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # The app's cache is pointed at an empty folder, so the tests never see or leave files
+    # in the real cache
+    cache = Cache(directory=str(tmp_path))
+    cache.register_cache()
+    monkeypatch.setattr(app_module, "cache", cache)
+    return app_module.app.test_client()
+
+
+@pytest.mark.parametrize("url", [
+    "/orbit_image?planet=Earth&resolution=abc",
+    "/orbit_image?planet=Earth&tolerance=1e-3x",
+    "/orbit_animation?planet=Earth&fps=fast",
+    "/orbit_animation?planet=Earth&max_frames=1.5",
+    "/spinograph?planet=Earth&planet=Mars&segments=many",
+    "/imaginary_orbit?centre=Earth&planet=Mars&span=long",
+    "/data/orbit?planet=Earth&max_points=all",
+])
+def test_unparsable_numbers_are_rejected(client, url):
+    response = client.get(url)
+
+    assert response.status_code == 400
+    assert b"must be" in response.data
+
+
+def test_unparsable_numbers_are_rejected_in_batch(client):
+    response = client.post("/batch", json={"charts": [{"chart": "orbit_image", "planet": "Earth", "resolution": "abc"}]})
+
+    assert response.status_code == 400
+    assert response.data == b"charts[0]: resolution must be an integer"
+
+
+def test_imaginary_orbit_endpoint_keys_the_centre_planet():
+    def filename(centre: str) -> str:
+        args = MultiDict([("centre", centre), ("planet", "Venus"), ("planet", "Mars"), ("format", "png")])
+        return app_module.charts["imaginary_orbit"](args)[0]
+
+    assert filename("Earth") != filename("Mars")
+
+
+def test_matching_if_none_match_is_answered_304_without_rendering(client):
+    etag = make_etag(orbit_image_key(["Earth", "Mars"], False))
+
+    response = client.get(f"/orbit_image?planet=Mars&planet=Earth&format=png&v={render_version}", headers={"If-None-Match": f'"{etag}"'})
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == f'"{etag}"'
+    assert response.headers["Cache-Control"] == app_module.versioned_cache_control
+    assert not app_module.cache.cache
+
+
+@pytest.mark.parametrize("accept, image_format", [
+    ("image/avif,image/webp,*/*;q=0.8", "webp"),
+    ("image/webp;q=0", "png"),
+    ("*/*", "png"),
+])
+def test_format_is_negotiated_from_accept(client, accept, image_format):
+    # Answered from the ETag, so the negotiated file is identified without rendering it
+    etag = make_etag(orbit_image_key(["Earth"], False, image_format=image_format))
+
+    response = client.get("/orbit_image?planet=Earth", headers={"Accept": accept, "If-None-Match": f'"{etag}"'})
+
+    assert response.status_code == 304
+    assert "Accept" in response.vary
+
+
+def test_explicit_format_does_not_vary_on_accept(client):
+    etag = make_etag(orbit_image_key(["Earth"], False, image_format="png"))
+
+    response = client.get("/orbit_image?planet=Earth&format=png", headers={"Accept": "image/webp", "If-None-Match": f'"{etag}"'})
+
+    assert response.status_code == 304
+    assert "Accept" not in response.vary
+
+
+def test_animation_format_is_negotiated_from_accept(client):
+    etag = make_etag(orbit_animation_key(["Earth"], False, animation_format="webp"))
+
+    response = client.get("/orbit_animation?planet=Earth", headers={"Accept": "image/webp,*/*", "If-None-Match": f'"{etag}"'})
+
+    assert response.status_code == 304
+    assert "Accept" in response.vary
+
+
+def test_batch_urls_fetch_the_files_the_batch_rendered(client, tmp_path):
+    # Already cached, so the batch does not render it
+    filename = orbit_image_key(["Earth", "Mars"], False, image_format="webp")
+    (tmp_path / filename).write_bytes(b"cached")
+
+    response = client.post("/batch", headers={"Accept": "image/webp"},
+                           json={"charts": [{"chart": "orbit_image", "planet": ["Mars", "Earth"], "v": 1, "_external": True}]})
+    entry = response.get_json()["charts"][0]
+
+    assert response.status_code == 200
+    assert entry["status"] == "ready"
+    assert entry["etag"] == make_etag(filename)
+    assert entry["url"].startswith("/orbit_image?") and entry["url"].count("v=") == 1
+    assert "format=webp" in entry["url"] and f"v={render_version}" in entry["url"]
+
+    # fetched without the POST's Accept header, the URL still names the same file
+    fetched = client.get(entry["url"])
+    assert fetched.status_code == 200
+    assert fetched.headers["ETag"] == f'"{entry["etag"]}"'
+    assert fetched.data == b"cached"
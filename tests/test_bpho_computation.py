@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from scipy.interpolate import interp1d
+
+from bpho_computation import OrbitSampling, adaptive_orbit_theta, calculate_angle_at_time
+from constants.data import Planet, get_planet
+
+
+def simpson_angle_at_time(t, P: float, ecc: float, theta0: float = 0) -> np.ndarray:
+    """
+    The cumulative-time table and cubic interpolation calculate_angle_at_time replaced
+    """
+    dtheta = 1/1000
+    N = np.ceil(t[-1] / P)
+    theta = np.arange(theta0, (2 * np.pi * N + theta0) + dtheta, dtheta)
+    f = (1 - ecc * np.cos(theta)) ** (-2)
+
+    L = len(theta)
+    isodd = np.remainder(np.arange(1, L-1), 2)
+    isodd[isodd == 1] = 4
+    isodd[isodd == 0] = 2
+    c = np.concatenate(([1], isodd, [1]))
+
+    tt = P * ((1 - ecc ** 2) ** (3/2)) * (1 / (2 * np.pi)) * dtheta * (1 / 3) * np.cumsum(c * f)
+    return interp1d(tt, theta, kind='cubic')(t)
+
+
+@pytest.mark.parametrize("name", ["Mercury", "Earth", "Mars", "Jupiter", "Pluto"])
+def test_angle_at_time_matches_simpson_table(name):
+    planet = get_planet(name)
+    t = np.linspace(planet.p / 100, 4.9 * planet.p, 800)
+
+    theta = calculate_angle_at_time(t, planet.p, planet.ecc, 0)
+
+    assert np.max(np.abs(theta - simpson_angle_at_time(t, planet.p, planet.ecc, 0))) < 7e-4
+
+
+def max_chord_error(planet: Planet, theta: np.ndarray) -> float:
+    """
+    Largest distance between the orbit and the straight lines joining the points at theta
+    """
+    ends = np.append(theta, theta[0] + 2 * np.pi)
+    between = np.linspace(ends[:-1], ends[1:], 65, axis=1)
+    r = planet.a * (1 - planet.ecc ** 2) / (1 - planet.ecc * np.cos(between))
+    x, y = r * np.cos(between), r * np.sin(between)
+
+    chord_x, chord_y = x[:, -1:] - x[:, :1], y[:, -1:] - y[:, :1]
+    cross = chord_x * (y - y[:, :1]) - chord_y * (x - x[:, :1])
+    return float(np.max(np.abs(cross) / np.hypot(chord_x, chord_y)))
+
+
+@pytest.mark.parametrize("planet", [get_planet("Mercury"), get_planet("Earth"), get_planet("Pluto"), Planet("Eccentric", 2.0, 0.9, 2.8, 2.8, 0)], ids=lambda planet: planet.name)
+@pytest.mark.parametrize("tolerance", [1e-2, 1e-3, 1e-4])
+def test_adaptive_sampling_stays_within_tolerance(planet, tolerance):
+    theta = adaptive_orbit_theta(planet, OrbitSampling(tolerance=tolerance))
+
+    assert max_chord_error(planet, theta) < tolerance * planet.a
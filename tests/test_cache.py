@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import Cache
+
+
+def make_cache(directory, **limits) -> Cache:
+    # Registered before any file is written, as the app does on its first lookup, since a
+    # new folder is cleared on first use
+    cache = Cache(directory=str(directory), **limits)
+    cache.register_cache()
+    return cache
+
+
+def write_file(cache: Cache, key: str, size: int) -> None:
+    with open(os.path.join(cache.directory, key), "wb") as file:
+        file.write(b"x" * size)
+
+
+def test_concurrent_get_or_render_renders_once(tmp_path):
+    cache = make_cache(tmp_path)
+    renders = []
+    lock = threading.Lock()
+
+    def render():
+        with lock:
+            renders.append(1)
+        time.sleep(0.2)
+        write_file(cache, "chart.png", 10)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: cache.get_or_render("chart.png", render, timeout=5), range(8)))
+
+    assert results == [True] * 8
+    assert len(renders) == 1
+    assert cache.get("chart.png")["size"] == 10
+
+
+def test_failed_render_is_retried_by_a_waiting_request(tmp_path):
+    cache = make_cache(tmp_path)
+    calls = []
+
+    def render():
+        calls.append(1)
+        time.sleep(0.1)
+        if len(calls) == 1:
+            raise RuntimeError("first render fails")
+        write_file(cache, "chart.png", 10)
+
+    def request():
+        try:
+            return cache.get_or_render("chart.png", render, timeout=5)
+        except RuntimeError:
+            return "failed"
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(request)
+        time.sleep(0.02)
+        second = executor.submit(request)
+        results = {first.result(), second.result()}
+
+    assert results == {"failed", True}
+    assert len(calls) == 2
+
+
+def test_eviction_removes_least_recently_used_and_keeps_byte_count(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=250)
+    for key in ("a.png", "b.png"):
+        write_file(cache, key, 100)
+        cache.set(key)
+    cache.get("a.png")
+
+    write_file(cache, "c.png", 100)
+    cache.set("c.png")
+
+    assert list(cache.cache) == ["a.png", "c.png"]
+    assert cache.total_bytes == 200
+    assert not os.path.exists(tmp_path / "b.png")
+
+
+def test_eviction_by_entry_count(tmp_path):
+    cache = make_cache(tmp_path, max_entries=2)
+    for key in ("a.png", "b.png", "c.png"):
+        write_file(cache, key, 10)
+        cache.set(key)
+
+    assert list(cache.cache) == ["b.png", "c.png"]
+    assert cache.total_bytes == 20
+
+
+def test_replacing_a_file_updates_byte_count(tmp_path):
+    cache = make_cache(tmp_path)
+    write_file(cache, "a.png", 100)
+    cache.set("a.png")
+    write_file(cache, "a.png", 40)
+    cache.set("a.png")
+    cache.delete("a.png")
+    write_file(cache, "b.png", 30)
+    cache.set("b.png")
+
+    assert cache.total_bytes == 30
+
+
+def test_files_written_by_another_process_are_adopted(tmp_path):
+    cache = make_cache(tmp_path)
+    write_file(cache, "warm.png", 50)
+
+    assert cache.get("warm.png")["size"] == 50
+    assert cache.total_bytes == 50
+    assert cache.get(".warm.png.tmp") is None
@@ -0,0 +1,43 @@
+import pytest
+
+from cache_keys import InvalidParameters, escape_name, imaginary_orbit_key, normalise_planets, orbit_image_key, planets_part
+
+
+def test_normalise_planets_sorts_in_catalogue_order_and_removes_duplicates():
+    assert normalise_planets(["Mars", "Earth", "Mercury", "Earth"]) == ["Mercury", "Earth", "Mars"]
+
+
+@pytest.mark.parametrize("names", [[], ["Earth", "Vulcan"], ["Earth", None]])
+def test_normalise_planets_rejects_missing_and_unknown_planets(names):
+    with pytest.raises(InvalidParameters):
+        normalise_planets(names)
+
+
+def test_every_ordering_of_the_same_planets_shares_a_key():
+    keys = {orbit_image_key(normalise_planets(names), False) for names in (["Earth", "Mars"], ["Mars", "Earth"], ["Mars", "Earth", "Mars"])}
+
+    assert keys == {"2d_img-Earth_Mars.png"}
+
+
+def test_imaginary_orbit_key_includes_the_centre_planet():
+    planets = normalise_planets(["Earth", "Mars", "Venus"])
+
+    assert imaginary_orbit_key("Earth", planets, False) != imaginary_orbit_key("Mars", planets, False)
+
+
+def test_escaped_names_never_share_a_key():
+    sets = [["A_B", "C"], ["A", "B_C"], ["A-B", "C"], ["A", "B-C"], ["A%5FB", "C"]]
+
+    assert len({planets_part(names) for names in sets}) == len(sets)
+    assert orbit_image_key(["A", "B_C"], False) != orbit_image_key(["A_B", "C"], False)
+
+
+@pytest.mark.parametrize("name", ["../Earth", "Earth/Moon", "Earth Moon", "Ceres\\1"])
+def test_escaped_names_are_plain_filenames(name):
+    escaped = escape_name(name)
+
+    assert "/" not in escaped and "\\" not in escaped and " " not in escaped
+
+
+def test_solar_system_names_are_not_escaped():
+    assert planets_part(["Mercury", "Earth", "Pluto"]) == "Mercury_Earth_Pluto"
@@ -0,0 +1,59 @@
+import os
+import threading
+import time
+
+import pytest
+
+from cache import Cache
+from render_queue import QueueFull, RenderQueue
+
+
+def make_queue(directory, max_queued: int) -> RenderQueue:
+    cache = Cache(directory=str(directory))
+    cache.register_cache()
+    return RenderQueue(cache, workers=1, max_queued=max_queued)
+
+
+def blocked_render(queue: RenderQueue, key: str, release: threading.Event):
+    def render(progress):
+        release.wait(5)
+        with open(os.path.join(queue.cache.directory, key), "wb") as file:
+            file.write(b"x")
+    return render
+
+
+def wait_until_running(job) -> None:
+    deadline = time.time() + 5
+    while job.status != "running" and time.time() < deadline:
+        time.sleep(0.01)
+    assert job.status == "running"
+
+
+def test_jobs_for_the_same_key_are_shared(tmp_path):
+    queue = make_queue(tmp_path, max_queued=4)
+    release = threading.Event()
+
+    job = queue.submit("a.gif", "/a", blocked_render(queue, "a.gif", release))
+    wait_until_running(job)
+    again = queue.submit("a.gif", "/a", blocked_render(queue, "a.gif", release))
+    release.set()
+
+    assert again is job
+    assert queue.wait(job, 5).status == "done"
+    assert queue.cache.get("a.gif") is not None
+
+
+def test_submit_raises_queue_full_once_max_queued_jobs_wait(tmp_path):
+    queue = make_queue(tmp_path, max_queued=1)
+    release = threading.Event()
+
+    running = queue.submit("a.gif", "/a", blocked_render(queue, "a.gif", release))
+    wait_until_running(running)
+    waiting = queue.submit("b.gif", "/b", blocked_render(queue, "b.gif", release))
+    with pytest.raises(QueueFull):
+        queue.submit("c.gif", "/c", blocked_render(queue, "c.gif", release))
+
+    # a job already waiting is still shared when the queue is full
+    assert queue.submit("b.gif", "/b", blocked_render(queue, "b.gif", release)) is waiting
+    release.set()
+    assert queue.wait(waiting, 5).status == "done"
@@ -1,34 +1,153 @@
-from bpho_service import generate_2d_orbit_animation ,generate_3d_orbit_animation
+"""
+Pre-renders the cache folder ahead of a deploy
+
+    python warmup.py [--workers N] [--endpoint orbit_animation ...]
+
+Renders are spread across a process pool (matplotlib is not thread-safe). Files that
+already exist in the cache folder are skipped, so an interrupted warmup can be resumed
+by running it again. Rendered files are registered in the cache index, so a running
+app serves them and counts them towards its size limits
+"""
+import argparse
 import itertools
+import os
+import time
+from multiprocessing import Pool
+
+from cache import Cache
+from formats import default_still_format, default_animation_format, still_preference, animation_preference
+from cache_keys import kepler_correlation_key, orbit_image_key, orbit_animation_key, angle_vs_time_key, spinograph_key, imaginary_orbit_key
+from bpho_service import generate_kepler_correlation, generate_2d_orbit, generate_3d_orbit, generate_2d_orbit_animation, generate_3d_orbit_animation, generate_angle_vs_time, generate_spinograph, generate_2d_imaginary_orbit, generate_3d_imaginary_orbit
 
 inner_planets = ["Mercury", "Venus", "Earth", "Mars"]
 complete_outer_planets = ["Jupiter", "Saturn", "Uranus", "Neptune", "Pluto"]
+all_planets = inner_planets + complete_outer_planets
+
+# Centre planet warmed for the imaginary orbits
+imaginary_centre_planet = "Earth"
+
+# Formats warmed: the defaults, and the formats browsers are negotiated to since their
+# image Accept headers list image/webp
+warmed_still_formats = [default_still_format] + still_preference[:1]
+warmed_animation_formats = [default_animation_format] + animation_preference[:1]
+
+
+## TASKS
+
+def planet_combinations(planets: list[str]):
+    for i in range(1, len(planets) + 1):
+        for combination in itertools.combinations(planets, i):
+            yield list(combination)
+
+
+def orbit_combinations():
+    # Inner and outer planets are never combined, their orbits are too different in size
+    yield from planet_combinations(inner_planets)
+    yield from planet_combinations(complete_outer_planets)
+
+
+def get_warmup_tasks() -> list[tuple]:
+    """
+    Every (endpoint, filename, generator, args, kwargs) the endpoints can be asked for,
+    in every warmed format, with the same cache keys as app.py
+    """
+    tasks = []
+    for image_format in warmed_still_formats:
+        options = {"image_format": image_format}
+        tasks.append(("kepler_correlation", kepler_correlation_key(image_format), generate_kepler_correlation, (), options))
+
+        for planets in orbit_combinations():
+            tasks.append(("orbit_image", orbit_image_key(planets, False, image_format=image_format), generate_2d_orbit, (planets,), options))
+            tasks.append(("orbit_image", orbit_image_key(planets, True, image_format=image_format), generate_3d_orbit, (planets,), options))
+
+        for planet in all_planets:
+            tasks.append(("angle_vs_time", angle_vs_time_key(planet, image_format), generate_angle_vs_time, (planet,), options))
+
+        for planets in itertools.combinations(all_planets, 2):
+            tasks.append(("spinograph", spinograph_key(list(planets), 1234, image_format=image_format), generate_spinograph, (list(planets),), options))
 
+        for planets in orbit_combinations():
+            if imaginary_centre_planet in planets:
+                continue
+            tasks.append(("imaginary_orbit", imaginary_orbit_key(imaginary_centre_planet, planets, False, image_format=image_format), generate_2d_imaginary_orbit, (imaginary_centre_planet, planets), options))
+            tasks.append(("imaginary_orbit", imaginary_orbit_key(imaginary_centre_planet, planets, True, image_format=image_format), generate_3d_imaginary_orbit, (imaginary_centre_planet, planets), options))
 
+    for animation_format in warmed_animation_formats:
+        options = {"animation_format": animation_format}
+        for planets in orbit_combinations():
+            tasks.append(("orbit_animation", orbit_animation_key(planets, False, animation_format=animation_format), generate_2d_orbit_animation, (planets,), options))
+            tasks.append(("orbit_animation", orbit_animation_key(planets, True, animation_format=animation_format), generate_3d_orbit_animation, (planets,), options))
 
+    return tasks
+
+
+## RUNNER
+
+def render_task(task: tuple) -> (str, float, str):
+    """
+    Renders one task. Cache files are written atomically, so an interrupted render never
+    leaves a file that looks finished
+    """
+    _, filename, generator, args, kwargs = task
+    start = time.perf_counter()
+
+    try:
+        generator(*args, filename, **kwargs)
+    except Exception as exc:
+        return filename, time.perf_counter() - start, repr(exc)
+
+    return filename, time.perf_counter() - start, None
+
+
+def run_warmup(workers: int = None, endpoints: list[str] = None) -> None:
+    tasks = [task for task in get_warmup_tasks() if endpoints is None or task[0] in endpoints]
+    cache = Cache()
+    pending = [task for task in tasks if cache.get(task[1]) is None]
+    print(f"{len(tasks) - len(pending)} of {len(tasks)} files already cached, rendering {len(pending)}")
+
+    start = time.perf_counter()
+    failed = 0
+    with Pool(processes=workers or os.cpu_count()) as pool:
+        for done, (filename, seconds, error) in enumerate(pool.imap_unordered(render_task, pending), start=1):
+            if error is None:
+                cache.set(filename)
+                print(f"[{done}/{len(pending)}] {filename} {seconds:.2f}s")
+            else:
+                failed += 1
+                print(f"[{done}/{len(pending)}] {filename} FAILED after {seconds:.2f}s: {error}")
+
+    print(f"Warmup finished in {time.perf_counter() - start:.1f}s, {failed} failed")
+
+
+# Serial warmups of the animations
 def warmup_inner_orbit_2d_animation():
-    for i in range(1, len(inner_planets) + 1):
-        for combination in itertools.combinations(inner_planets, i):
-            print("Generating 2D animation for " + str(combination))
-            generate_2d_orbit_animation(list(combination), "2d_anim-" + "_".join(combination) + ".gif")
+    for combination in planet_combinations(inner_planets):
+        print("Generating 2D animation for " + str(combination))
+        generate_2d_orbit_animation(combination, orbit_animation_key(combination, False))
 
 
 def warmup_inner_orbit_3d_animation():
-    for i in range(1, len(inner_planets) + 1):
-        for combination in itertools.combinations(inner_planets, i):
-            print("Generating 3D animation for " + str(combination))
-            generate_3d_orbit_animation(list(combination), "3d_anim-" + "_".join(combination) + ".gif")
+    for combination in planet_combinations(inner_planets):
+        print("Generating 3D animation for " + str(combination))
+        generate_3d_orbit_animation(combination, orbit_animation_key(combination, True))
 
 
 def warmup_outer_orbit_2d_animation():
-    for i in range(1, len(complete_outer_planets) + 1):
-        for combination in itertools.combinations(complete_outer_planets, i):
-            print("Generating 2D animation for " + str(combination))
-            generate_2d_orbit_animation(list(combination), "2d_anim-" + "_".join(combination) + ".gif")
+    for combination in planet_combinations(complete_outer_planets):
+        print("Generating 2D animation for " + str(combination))
+        generate_2d_orbit_animation(combination, orbit_animation_key(combination, False))
 
 
 def warmup_outer_orbit_3d_animation():
-    for i in range(1, len(complete_outer_planets) + 1):
-        for combination in itertools.combinations(complete_outer_planets, i):
-            print("Generating 3D animation for " + str(combination))
-            generate_3d_orbit_animation(list(combination), "3d_anim-" + "_".join(combination) + ".gif")
\ No newline at end of file
+    for combination in planet_combinations(complete_outer_planets):
+        print("Generating 3D animation for " + str(combination))
+        generate_3d_orbit_animation(combination, orbit_animation_key(combination, True))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-render the cache folder")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of cores)")
+    parser.add_argument("--endpoint", action="append", dest="endpoints", help="only warm this endpoint, may be repeated")
+    args = parser.parse_args()
+
+    run_warmup(args.workers, args.endpoints)